@@ -0,0 +1,138 @@
+"""Stock flow history and supply forecasts
+
+daily_stock_flows (migration 5) holds one row per day and blood type with
+the millilitres donated, issued, expired and requested that day. Triggers
+keep it current as units and requests are written, so reports read a few
+thousand rollup rows instead of scanning blood_bank and blood_requests.
+Rows are streamed into [day x blood type] NumPy matrices and every
+statistic is computed on whole columns.
+
+issued_ml is recorded as units leave stock, which allocation does by
+deleting them; days before the migration only have an estimate taken from
+fulfilled requests. unmet_ml is what was requested and left pending on the
+day it was asked for, whether or not match-pending filled it later.
+
+Registration does not validate blood types, so rows whose type is not in
+BLOOD_TYPES are left out of every report rather than failing it.
+"""
+from collections import namedtuple
+from compatibility import BLOOD_TYPES
+from database import CursorFromConnectionPool
+import datetime
+
+import numpy as np
+
+FLOW_COLUMNS = ('donated_ml', 'donated_units', 'issued_ml', 'expired_ml', 'expired_units', 'requested_ml', 'unmet_ml')
+FETCH_SIZE = 2000
+
+_TYPE_INDEX = {blood_type: i for i, blood_type in enumerate(BLOOD_TYPES)}
+
+DailyFlows = namedtuple('DailyFlows', ['days'] + list(FLOW_COLUMNS))
+SupplyForecast = namedtuple('SupplyForecast', [
+    'blood_type', 'stock_ml', 'usable_ml', 'projected_waste_ml', 'donated_ml_per_day', 'issued_ml_per_day',
+    'demand_ml_per_day', 'unmet_ml', 'waste_fraction', 'days_of_supply', 'stockout_date',
+])
+
+
+def _stream(cursor, sql, params):
+    cursor.execute(sql, params)
+    while True:
+        rows = cursor.fetchmany(FETCH_SIZE)
+        if not rows:
+            return
+        yield rows
+
+
+def daily_flows(start, end):
+    """Flows for every day from start to end inclusive, as DailyFlows of [day x BLOOD_TYPES] arrays
+
+    days is a datetime64[D] array; days without activity are zero.
+    """
+    days = np.arange(np.datetime64(start, 'D'), np.datetime64(end, 'D') + 1)
+    matrices = {column: np.zeros((len(days), len(BLOOD_TYPES)), dtype=np.int64) for column in FLOW_COLUMNS}
+    if not len(days):
+        return DailyFlows(days, **matrices)
+    with CursorFromConnectionPool() as cursor:
+        for rows in _stream(cursor, f"""
+                SELECT day, blood_type, {', '.join(FLOW_COLUMNS)} FROM daily_stock_flows
+                WHERE day BETWEEN ? AND ?
+                """, (str(days[0]), str(days[-1]))):
+            day, blood_type, *values = zip(*rows)
+            day_index = (np.array(day, dtype='datetime64[D]') - days[0]).astype(np.int64)
+            type_index = np.fromiter((_TYPE_INDEX.get(t, -1) for t in blood_type), dtype=np.int64, count=len(rows))
+            known = type_index >= 0
+            for column, column_values in zip(FLOW_COLUMNS, values):
+                matrices[column][day_index[known], type_index[known]] = np.array(column_values)[known]
+    return DailyFlows(days, **matrices)
+
+
+def _expiry_profile(cursor, today):
+    """Live stock as {blood_type: (days until expiry, ml)} arrays, soonest first"""
+    batches = {blood_type: ([], []) for blood_type in BLOOD_TYPES}
+    for rows in _stream(cursor, """
+            SELECT blood_type, expiry_date, SUM(quantity_ml) FROM blood_bank
+            WHERE expiry_date > ? GROUP BY blood_type, expiry_date ORDER BY blood_type, expiry_date
+            """, (today.isoformat(),)):
+        for blood_type, expiry_date, quantity_ml in rows:
+            if blood_type not in batches:
+                continue
+            expiries, quantities = batches[blood_type]
+            expiries.append(expiry_date)
+            quantities.append(quantity_ml)
+    origin = np.datetime64(today, 'D')
+    return {
+        blood_type: ((np.array(expiries, dtype='datetime64[D]') - origin).astype(np.float64),
+                     np.array(quantities, dtype=np.float64))
+        for blood_type, (expiries, quantities) in batches.items()
+    }
+
+
+def usable_stock(days_to_expiry, quantities, demand_per_day):
+    """Millilitres used before expiring if demand takes the soonest-expiring units first
+
+    With S the running total of stock by expiry and d the days until each
+    batch expires, the amount used by the time batch i expires is
+    S[i] + min(0, min over j <= i of (demand * d[j] - S[j])).
+    """
+    if not len(quantities):
+        return 0.0
+    cumulative = np.cumsum(quantities)
+    shortfall = np.minimum.accumulate(demand_per_day * days_to_expiry - cumulative)
+    return float(cumulative[-1] + min(0.0, shortfall[-1]))
+
+
+def forecast(window_days=28, today=None):
+    """SupplyForecast for every blood type from the last window_days complete days of flows
+
+    Demand is the mean requested_ml per day. days_of_supply is how long the
+    stock that will be used before it expires lasts at that demand, without
+    counting future donations; it is None when there is no demand.
+    """
+    if window_days < 1:
+        raise ValueError("window_days must be at least 1")
+    today = today or datetime.date.today()
+    flows = daily_flows(today - datetime.timedelta(days=window_days), today - datetime.timedelta(days=1))
+    donated = flows.donated_ml.mean(axis=0)
+    issued = flows.issued_ml.mean(axis=0)
+    demand = flows.requested_ml.mean(axis=0)
+    unmet = flows.unmet_ml.sum(axis=0)
+    # Share of the stock that left in the window which left by expiring
+    expired = flows.expired_ml.sum(axis=0)
+    outflow = expired + flows.issued_ml.sum(axis=0)
+    waste_fraction = np.divide(expired, outflow, out=np.zeros(len(BLOOD_TYPES)), where=outflow > 0)
+
+    with CursorFromConnectionPool() as cursor:
+        profile = _expiry_profile(cursor, today)
+
+    forecasts = []
+    for i, blood_type in enumerate(BLOOD_TYPES):
+        days_to_expiry, quantities = profile[blood_type]
+        stock = float(quantities.sum())
+        usable = usable_stock(days_to_expiry, quantities, demand[i])
+        days_of_supply = float(usable / demand[i]) if demand[i] > 0 else None
+        stockout = today + datetime.timedelta(days=int(days_of_supply)) if days_of_supply is not None else None
+        forecasts.append(SupplyForecast(
+            blood_type, int(stock), int(usable), int(stock - usable), float(donated[i]), float(issued[i]),
+            float(demand[i]), int(unmet[i]), float(waste_fraction[i]), days_of_supply, stockout,
+        ))
+    return forecasts
@@ -1,105 +1,189 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash
-from werkzeug.security import generate_password_hash, check_password_hash
-from database import Database, CursorFromConnectionPool
+from flask import Flask, render_template, request, redirect, url_for, session, flash, g, abort, Response, stream_with_context
+from database import Database, CursorFromConnectionPool, QueryCounter, backend_from_environment
+from events import broker as inventory_broker
+from inventory import (availability_cache, cached_available_ml, invalidate_availability, inventory_document,
+                       record_blood_request, request_committed, snapshot_cache)
+from housekeeping import Housekeeper
+from jinja2 import FileSystemBytecodeCache
+from markupsafe import Markup
+from metrics import format_sample, query_stats
+from cache import TTLCache
+from ratelimit import check as check_rate_limits, limiters as rate_limiters
+from passwords import HashingBusyError, hash_password, verify_password, configure as configure_password_hashing
+from repositories import (DONATION_MAX_ML, DONATION_MIN_ML, DonorRepo, RecipientRepo, InventoryRepo, next_donation_date,
+                          next_request_date)
+from writer import WriteTimeoutError, configure as configure_write_batching, current_writer, execute as execute_write
 import datetime
+import os
 import sqlite3
 
 app = Flask(__name__)
 app.secret_key = 'your_secret_key_here'
 
-# Initialize database connection
-Database.initialize()
+# Compiled templates are kept on disk, so worker processes load bytecode
+# instead of compiling every template again. Without BLOOD_BANK_TEMPLATE_CACHE
+# Jinja picks a private per-user directory and checks that it owns it, so
+# other local users cannot plant bytecode for the app to run.
+template_cache_dir = os.environ.get('BLOOD_BANK_TEMPLATE_CACHE')
+app.jinja_options = dict(app.jinja_options, bytecode_cache=FileSystemBytecodeCache(template_cache_dir))
+
+def precompile_templates():
+    """Compile every template once at startup, filling the bytecode cache"""
+    for name in app.jinja_env.list_templates(extensions=['html']):
+        app.jinja_env.get_template(name)
+
+precompile_templates()
+
+# Rendered dashboard sections. History keys carry the person's
+# history_version, which triggers bump on every change, so entries never go
+# stale; the TTL only bounds how long superseded versions linger.
+fragment_cache = TTLCache(
+    ttl=600.0,
+    max_entries=2048,
+    enabled=os.environ.get('BLOOD_BANK_FRAGMENT_CACHE', 'on').lower() not in ('0', 'off', 'false'),
+)
+
+# Initialize database connection; BLOOD_BANK_SHARDS selects a sharded layout
+# and BLOOD_BANK_BUSY_TIMEOUT_MS the lock wait. Each worker process keeps up
+# to BLOOD_BANK_POOL_SIZE connections per shard and waits at most
+# BLOOD_BANK_POOL_TIMEOUT seconds for a free one.
+Database.initialize(
+    pool_size=int(os.environ.get('BLOOD_BANK_POOL_SIZE', 8)),
+    pool_timeout=float(os.environ.get('BLOOD_BANK_POOL_TIMEOUT', 30.0)),
+    backend=backend_from_environment(),
+)
+
+# With several shards, the front end names each request's region in this header
+SHARD_HEADER = os.environ.get('BLOOD_BANK_SHARD_HEADER', 'X-Blood-Bank-Region')
+
+# Start the password hashing workers before any other threads exist
+configure_password_hashing()
+
+# Donation and request writes go through one group-commit writer thread
+# when BLOOD_BANK_WRITE_BATCHING=on; otherwise each commits on its own
+configure_write_batching()
+
+# Sweep expired units and match pending requests in the background;
+# BLOOD_BANK_HOUSEKEEPING_INTERVAL=0 turns it off (use manage.py instead)
+housekeeper = Housekeeper(interval=float(os.environ.get('BLOOD_BANK_HOUSEKEEPING_INTERVAL', 300)))
+if housekeeper.interval > 0:
+    housekeeper.start()
+
+# Route every request to its region's shard. A logged-in session stays on
+# the shard it logged in to; ids are only unique within a shard, so a header
+# naming another one is refused rather than followed.
+@app.before_request
+def select_shard():
+    shards = Database.shards()
+    shard = request.headers.get(SHARD_HEADER) if len(shards) > 1 else None
+    if shard is not None and shard not in shards:
+        abort(404)
+    if len(shards) > 1 and ('donor_id' in session or 'recipient_id' in session):
+        if session.get('shard') not in shards:
+            # Logged in before sessions recorded their shard, or the shard is gone
+            session.clear()
+        elif shard is not None and shard != session['shard']:
+            abort(403)
+        else:
+            shard = session['shard']
+    g.shard_scope = Database.use_shard(shard or shards[0])
+    g.shard_scope.__enter__()
+
+@app.teardown_request
+def release_shard(exception):
+    scope = g.pop('shard_scope', None)
+    if scope is not None:
+        scope.__exit__(None, None, None)
+
+# Count SQL statements per request; exposed as a response header in debug
+# and testing so query-count regressions show up
+@app.before_request
+def start_query_counter():
+    g.query_counter = QueryCounter().__enter__()
+
+@app.after_request
+def stop_query_counter(response):
+    counter = g.pop('query_counter', None)
+    if counter is not None:
+        counter.__exit__(None, None, None)
+        if app.debug or app.testing:
+            response.headers['X-SQL-Statements'] = str(counter.count)
+    return response
+
+@app.context_processor
+def inject_now():
+    return {'now': datetime.datetime.now()}
 
 # Helper functions
-def create_blood_bank_entry(blood_type, quantity_ml, donor_id):
-    collection_date = datetime.date.today()
-    expiry_date = collection_date + datetime.timedelta(days=42)  # Blood typically expires in 42 days
-    
-    with CursorFromConnectionPool() as cursor:
-        cursor.execute(
-            "INSERT INTO blood_bank (blood_type, quantity_ml, donor_id, collection_date, expiry_date) VALUES (?, ?, ?, ?, ?)",
-            (blood_type, quantity_ml, donor_id, collection_date, expiry_date)
-        )
+def render_fragment(key, template, load_context):
+    """Rendered template for key from fragment_cache; load_context() supplies its variables on a miss"""
+    return fragment_cache.get_or_load(
+        (Database.current_shard(),) + key,
+        lambda: Markup(render_template(template, **load_context()))
+    )
 
-def can_donor_donate(donor_id):
-    """Check if donor is eligible to donate based on last donation date"""
-    with CursorFromConnectionPool() as cursor:
-        cursor.execute("SELECT last_donation_date FROM donors WHERE id = ?", (donor_id,))
-        result = cursor.fetchone()
-        
-        if result and result[0]:
-            last_donation_date = datetime.datetime.strptime(result[0], '%Y-%m-%d').date()
-            days_since_donation = (datetime.date.today() - last_donation_date).days
-            return days_since_donation >= 60
-        
-        return True  # If no previous donation or date is null
+def create_blood_bank_entry(blood_type, quantity_ml, donor_id, cursor=None):
+    """Add a donated unit; pass cursor to write inside the caller's transaction"""
+    if cursor is None:
+        with CursorFromConnectionPool() as cursor:
+            InventoryRepo.add_unit(cursor, blood_type, quantity_ml, donor_id)
+        stock_changed(blood_type)
+    else:
+        InventoryRepo.add_unit(cursor, blood_type, quantity_ml, donor_id)
 
-def can_recipient_request(recipient_id):
-    """Check if recipient is eligible to request based on last request date"""
-    with CursorFromConnectionPool() as cursor:
-        cursor.execute("SELECT last_request_date FROM recipients WHERE id = ?", (recipient_id,))
-        result = cursor.fetchone()
-        
-        if result and result[0]:
-            last_request_date = datetime.datetime.strptime(result[0], '%Y-%m-%d').date()
-            days_since_request = (datetime.date.today() - last_request_date).days
-            return days_since_request >= 40
-        
-        return True  # If no previous request or date is null
+def record_donation(cursor, donor_id, quantity_ml):
+    """Donation write for execute_write: the donor's blood type, or None if they cannot donate yet"""
+    quantity_ml = int(quantity_ml)
+    if not DONATION_MIN_ML <= quantity_ml <= DONATION_MAX_ML:
+        raise ValueError(f"quantity_ml {quantity_ml} outside {DONATION_MIN_ML}-{DONATION_MAX_ML}")
+    blood_type, last_donation_date = DonorRepo.donation_profile(cursor, donor_id)
+    if next_donation_date(last_donation_date) is not None:
+        return None
+    DonorRepo.record_donation(cursor, donor_id, datetime.date.today())
+    create_blood_bank_entry(blood_type, quantity_ml, donor_id, cursor)
+    return blood_type
 
-def is_blood_available(blood_type, quantity_requested):
-    """Check if requested blood type and quantity is available"""
-    with CursorFromConnectionPool() as cursor:
-        cursor.execute("""
-            SELECT SUM(quantity_ml) as total_quantity 
-            FROM blood_bank 
-            WHERE blood_type = ? AND expiry_date > ?
-            GROUP BY blood_type
-        """, (blood_type, datetime.date.today()))
-        
-        result = cursor.fetchone()
-        
-        if result and result[0] >= int(quantity_requested):
-            return True
-        
-        return False
+def log_in(role, person_id, name):
+    """Store a login in the session, pinned to the current shard
 
-def fulfill_blood_request(blood_type, quantity_requested):
-    """Subtract the requested blood quantity from available blood"""
-    with CursorFromConnectionPool() as cursor:
-        # Get blood entries starting with oldest first (FIFO)
-        cursor.execute("""
-            SELECT id, quantity_ml 
-            FROM blood_bank 
-            WHERE blood_type = ? AND expiry_date > ? 
-            ORDER BY collection_date ASC
-        """, (blood_type, datetime.date.today()))
-        
-        blood_entries = cursor.fetchall()
-        remaining_quantity = int(quantity_requested)
-        
-        # Process each entry until request is fulfilled
-        for entry_id, entry_quantity in blood_entries:
-            if remaining_quantity <= entry_quantity:
-                # This entry has enough to fulfill remaining request
-                new_quantity = entry_quantity - remaining_quantity
-                if new_quantity == 0:
-                    # Remove entry if fully used
-                    cursor.execute("DELETE FROM blood_bank WHERE id = ?", (entry_id,))
-                else:
-                    # Update entry with reduced quantity
-                    cursor.execute("UPDATE blood_bank SET quantity_ml = ? WHERE id = ?", 
-                                 (new_quantity, entry_id))
-                break
-            else:
-                # Use entire entry and continue to next
-                cursor.execute("DELETE FROM blood_bank WHERE id = ?", (entry_id,))
-                remaining_quantity -= entry_quantity
+    Logging in on another shard ends the session's other login, whose id
+    would mean someone else there.
+    """
+    if session.get('shard') != Database.current_shard():
+        session.clear()
+    session['shard'] = Database.current_shard()
+    session[f'{role}_id'] = person_id
+    session[f'{role}_name'] = name
+
+def too_many_attempts(template, retry_after):
+    """429 response re-rendering template, for a form POST that hit a rate limit"""
+    flash('Too many attempts, please try again in a few minutes.')
+    return render_template(template), 429, {'Retry-After': str(retry_after)}
+
+def history_page_key():
+    """(date, id) keyset from ?before_date=&before_id=, or None for the first page"""
+    before_date = request.args.get('before_date')
+    before_id = request.args.get('before_id', type=int)
+    if not before_date or before_id is None:
+        return None
+    return before_date, before_id
+
+def stock_changed(blood_type):
+    """Call once new stock of blood_type has been committed"""
+    invalidate_availability(blood_type)
+    housekeeper.notify_stock()
+
+def when_written(future, committed):
+    """Call committed(result) if a write that timed out commits with a result later"""
+    def done(future):
+        if not future.cancelled() and future.exception() is None and future.result() is not None:
+            committed(future.result())
+    future.add_done_callback(done)
 
 # Routes
 @app.route('/')
 def home():
-    return render_template('home.html', now=datetime.datetime.now())
+    return render_template('home.html')
 
 # Donor routes
 @app.route('/donor/register', methods=['GET', 'POST'])
@@ -112,17 +196,17 @@ def donor_register():
         phone = request.form['phone']
         address = request.form['address']
         
-        hashed_password = generate_password_hash(password)
+        # Checked before hashing, so floods of sign-ups cost no CPU
+        retry_after = check_rate_limits(('register_ip', request.remote_addr),
+                                        ('register_email', f'donor:{email.lower()}'))
+        if retry_after:
+            return too_many_attempts('donor_register.html', retry_after)
         
         try:
+            hashed_password = hash_password(password)
+            
             with CursorFromConnectionPool() as cursor:
-                cursor.execute(
-                    "INSERT INTO donors (name, email, password, blood_type, phone, address) VALUES (?, ?, ?, ?, ?, ?)",
-                    (name, email, hashed_password, blood_type, phone, address)
-                )
-                # Get the last inserted row id
-                cursor.execute("SELECT last_insert_rowid()")
-                donor_id = cursor.fetchone()[0]
+                donor_id = DonorRepo.create(cursor, name, email, hashed_password, blood_type, phone, address)
                 print(f"Successfully registered donor with ID: {donor_id}")
             
             flash('Registration successful! Please login.')
@@ -132,10 +216,12 @@ def donor_register():
                 flash('Email address already registered.')
             else:
                 flash(f'An error occurred: {str(e)}')
+        except HashingBusyError:
+            flash('The server is busy, please try again in a moment.')
         except Exception as e:
             flash(f'An error occurred: {str(e)}')
     
-    return render_template('donor_register.html', now=datetime.datetime.now())
+    return render_template('donor_register.html')
 
 @app.route('/donor/login', methods=['GET', 'POST'])
 def donor_login():
@@ -143,30 +229,40 @@ def donor_login():
         email = request.form['email']
         password = request.form['password']
         
+        # Checked before the lookup and the hash, so credential stuffing is cheap to turn away
+        retry_after = check_rate_limits(('login_ip', request.remote_addr), ('login_email', f'donor:{email.lower()}'))
+        if retry_after:
+            return too_many_attempts('donor_login.html', retry_after)
+        
         try:
             with CursorFromConnectionPool() as cursor:
-                cursor.execute("SELECT id, name, password FROM donors WHERE email = ?", (email,))
-                donor = cursor.fetchone()
+                donor = DonorRepo.find_login(cursor, email)
+            
+            if donor:
+                donor_id = donor[0]
+                donor_name = donor[1]
+                stored_password = donor[2]
                 
-                if donor:
-                    # Access using index since we're using fetchone()
-                    donor_id = donor[0]
-                    donor_name = donor[1]
-                    stored_password = donor[2]
-                    
-                    if check_password_hash(stored_password, password):
-                        session['donor_id'] = donor_id
-                        session['donor_name'] = donor_name
-                        flash(f'Welcome back, {donor_name}!')
-                        return redirect(url_for('donor_dashboard'))
-                    else:
-                        flash('Invalid email or password')
+                # Hashing runs in the worker pool, not while holding a connection
+                matches, new_hash = verify_password(stored_password, password)
+                if matches:
+                    if new_hash:
+                        # Upgrade hashes made with older parameters
+                        with CursorFromConnectionPool() as cursor:
+                            DonorRepo.update_password(cursor, donor_id, new_hash)
+                    log_in('donor', donor_id, donor_name)
+                    flash(f'Welcome back, {donor_name}!')
+                    return redirect(url_for('donor_dashboard'))
                 else:
                     flash('Invalid email or password')
+            else:
+                flash('Invalid email or password')
+        except HashingBusyError:
+            flash('The server is busy, please try again in a moment.')
         except Exception as e:
             flash(f'Login error: {str(e)}')
     
-    return render_template('donor_login.html', now=datetime.datetime.now())
+    return render_template('donor_login.html')
 
 @app.route('/donor/dashboard')
 def donor_dashboard():
@@ -176,29 +272,28 @@ def donor_dashboard():
     
     donor_id = session['donor_id']
     
+    before = history_page_key()
+
     with CursorFromConnectionPool() as cursor:
-        # Get donor details
-        cursor.execute("SELECT * FROM donors WHERE id = ?", (donor_id,))
-        donor = cursor.fetchone()
-        
-        # Get donation history
-        cursor.execute("SELECT * FROM blood_bank WHERE donor_id = ? ORDER BY collection_date DESC", (donor_id,))
-        donations = cursor.fetchall()
+        # Get donor details; the history page is only queried when its
+        # rendered fragment is not cached for the current history_version
+        donor = DonorRepo.profile(cursor, donor_id)
+
+        def history_context():
+            donations, next_page = DonorRepo.donations(cursor, donor_id, before)
+            return {'donations': donations, 'next_page': next_page}
+
+        donation_history = render_fragment(('donations', donor_id, donor.history_version, before),
+                                           'donation_history.html', history_context)
     
     # Check if donor can donate again
-    can_donate = can_donor_donate(donor_id)
-    next_donation_date = None
-    
-    if not can_donate and donor[7]:  # If last_donation_date exists
-        last_date = datetime.datetime.strptime(donor[7], '%Y-%m-%d').date()
-        next_donation_date = last_date + datetime.timedelta(days=60)
+    next_date = next_donation_date(donor.last_donation_date)
     
     return render_template('donor_dashboard.html', 
                           donor=donor, 
-                          donations=donations, 
-                          can_donate=can_donate,
-                          next_donation_date=next_donation_date,
-                          now=datetime.datetime.now())
+                          donation_history=donation_history,
+                          can_donate=next_date is None,
+                          next_donation_date=next_date)
 
 @app.route('/donor/donate', methods=['POST'])
 def donor_donate():
@@ -207,25 +302,25 @@ def donor_donate():
         return redirect(url_for('donor_login'))
     
     donor_id = session['donor_id']
+    quantity_ml = request.form.get('quantity_ml', type=int)
+    if quantity_ml is None or not DONATION_MIN_ML <= quantity_ml <= DONATION_MAX_ML:
+        flash(f'Please enter a donation between {DONATION_MIN_ML} and {DONATION_MAX_ML} ml.')
+        return redirect(url_for('donor_dashboard'))
+    
+    # Check eligibility, record the donation and add the unit in one transaction
+    try:
+        blood_type = execute_write(record_donation, donor_id, quantity_ml)
+    except WriteTimeoutError as e:
+        when_written(e.future, stock_changed)
+        flash('Your donation is taking longer than usual to save. Please check your history before trying again.')
+        return redirect(url_for('donor_dashboard'))
     
     # Check if donor can donate
-    if not can_donor_donate(donor_id):
+    if blood_type is None:
         flash('You cannot donate yet. Donors must wait 60 days between donations.')
         return redirect(url_for('donor_dashboard'))
     
-    quantity_ml = request.form['quantity_ml']
-    
-    # Get donor's blood type
-    with CursorFromConnectionPool() as cursor:
-        cursor.execute("SELECT blood_type FROM donors WHERE id = ?", (donor_id,))
-        blood_type = cursor.fetchone()[0]
-        
-        # Update last donation date
-        cursor.execute("UPDATE donors SET last_donation_date = ? WHERE id = ?", 
-                      (datetime.date.today(), donor_id))
-    
-    # Create blood bank entry
-    create_blood_bank_entry(blood_type, quantity_ml, donor_id)
+    stock_changed(blood_type)
     
     flash('Thank you for your donation!')
     return redirect(url_for('donor_dashboard'))
@@ -249,17 +344,18 @@ def recipient_register():
         address = request.form['address']
         medical_condition = request.form['medical_condition']
         
-        hashed_password = generate_password_hash(password)
+        # Checked before hashing, so floods of sign-ups cost no CPU
+        retry_after = check_rate_limits(('register_ip', request.remote_addr),
+                                        ('register_email', f'recipient:{email.lower()}'))
+        if retry_after:
+            return too_many_attempts('recipient_register.html', retry_after)
         
         try:
+            hashed_password = hash_password(password)
+            
             with CursorFromConnectionPool() as cursor:
-                cursor.execute(
-                    "INSERT INTO recipients (name, email, password, blood_type, phone, address, medical_condition) VALUES (?, ?, ?, ?, ?, ?, ?)",
-                    (name, email, hashed_password, blood_type, phone, address, medical_condition)
-                )
-                # Get the last inserted row id
-                cursor.execute("SELECT last_insert_rowid()")
-                recipient_id = cursor.fetchone()[0]
+                recipient_id = RecipientRepo.create(cursor, name, email, hashed_password, blood_type,
+                                                    phone, address, medical_condition)
             
             flash('Registration successful! Please login.')
             return redirect(url_for('recipient_login'))
@@ -268,10 +364,12 @@ def recipient_register():
                 flash('Email address already registered.')
             else:
                 flash(f'An error occurred: {str(e)}')
+        except HashingBusyError:
+            flash('The server is busy, please try again in a moment.')
         except Exception as e:
             flash(f'An error occurred: {str(e)}')
     
-    return render_template('recipient_register.html', now=datetime.datetime.now())
+    return render_template('recipient_register.html')
 
 @app.route('/recipient/login', methods=['GET', 'POST'])
 def recipient_login():
@@ -279,29 +377,40 @@ def recipient_login():
         email = request.form['email']
         password = request.form['password']
         
+        # Checked before the lookup and the hash, so credential stuffing is cheap to turn away
+        retry_after = check_rate_limits(('login_ip', request.remote_addr), ('login_email', f'recipient:{email.lower()}'))
+        if retry_after:
+            return too_many_attempts('recipient_login.html', retry_after)
+        
         try:
             with CursorFromConnectionPool() as cursor:
-                cursor.execute("SELECT id, name, password FROM recipients WHERE email = ?", (email,))
-                recipient = cursor.fetchone()
+                recipient = RecipientRepo.find_login(cursor, email)
+            
+            if recipient:
+                recipient_id = recipient[0]
+                recipient_name = recipient[1]
+                stored_password = recipient[2]
                 
-                if recipient:
-                    recipient_id = recipient[0]
-                    recipient_name = recipient[1]
-                    stored_password = recipient[2]
-                    
-                    if check_password_hash(stored_password, password):
-                        session['recipient_id'] = recipient_id
-                        session['recipient_name'] = recipient_name
-                        flash(f'Welcome back, {recipient_name}!')
-                        return redirect(url_for('recipient_dashboard'))
-                    else:
-                        flash('Invalid email or password')
+                # Hashing runs in the worker pool, not while holding a connection
+                matches, new_hash = verify_password(stored_password, password)
+                if matches:
+                    if new_hash:
+                        # Upgrade hashes made with older parameters
+                        with CursorFromConnectionPool() as cursor:
+                            RecipientRepo.update_password(cursor, recipient_id, new_hash)
+                    log_in('recipient', recipient_id, recipient_name)
+                    flash(f'Welcome back, {recipient_name}!')
+                    return redirect(url_for('recipient_dashboard'))
                 else:
                     flash('Invalid email or password')
+            else:
+                flash('Invalid email or password')
+        except HashingBusyError:
+            flash('The server is busy, please try again in a moment.')
         except Exception as e:
             flash(f'Login error: {str(e)}')
     
-    return render_template('recipient_login.html', now=datetime.datetime.now())
+    return render_template('recipient_login.html')
 
 @app.route('/recipient/dashboard')
 def recipient_dashboard():
@@ -311,44 +420,36 @@ def recipient_dashboard():
     
     recipient_id = session['recipient_id']
     
+    before = history_page_key()
+
     with CursorFromConnectionPool() as cursor:
-        # Get recipient details
-        cursor.execute("SELECT * FROM recipients WHERE id = ?", (recipient_id,))
-        recipient = cursor.fetchone()
+        # Get recipient details; the history page is only queried when its
+        # rendered fragment is not cached for the current history_version
+        recipient = RecipientRepo.profile(cursor, recipient_id)
+
+        def history_context():
+            requests, next_page = RecipientRepo.requests(cursor, recipient_id, before)
+            return {'requests': requests, 'next_page': next_page}
+
+        request_history = render_fragment(('requests', recipient_id, recipient.history_version, before),
+                                          'request_history.html', history_context)
         
         # Get available blood of matching type
-        cursor.execute("""
-            SELECT blood_type, SUM(quantity_ml) as total_quantity 
-            FROM blood_bank 
-            WHERE blood_type = ? AND expiry_date > ?
-            GROUP BY blood_type
-        """, (recipient[4], datetime.date.today()))
-        
-        available_blood = cursor.fetchone()
-        
-        # Get request history
-        cursor.execute("""
-            SELECT * FROM blood_requests 
-            WHERE recipient_id = ? 
-            ORDER BY request_date DESC
-        """, (recipient_id,))
-        requests = cursor.fetchall()
+        blood_type = recipient.blood_type
+        total_quantity = cached_available_ml(cursor, blood_type)
+        available_blood = (blood_type, total_quantity) if total_quantity else None
+        available_section = render_fragment(('available', blood_type, total_quantity), 'available_blood.html',
+                                            lambda: {'available_blood': available_blood, 'blood_type': blood_type})
     
     # Check if recipient can request again
-    can_request = can_recipient_request(recipient_id)
-    next_request_date = None
-    
-    if not can_request and recipient[8]:  # If last_request_date exists
-        last_date = datetime.datetime.strptime(recipient[8], '%Y-%m-%d').date()
-        next_request_date = last_date + datetime.timedelta(days=40)
+    next_date = next_request_date(recipient.last_request_date)
     
     return render_template('recipient_dashboard.html', 
                           recipient=recipient, 
-                          available_blood=available_blood, 
-                          requests=requests,
-                          can_request=can_request,
-                          next_request_date=next_request_date,
-                          now=datetime.datetime.now())
+                          available_section=available_section,
+                          request_history=request_history,
+                          can_request=next_date is None,
+                          next_request_date=next_date)
 
 @app.route('/recipient/request', methods=['POST'])
 def recipient_request():
@@ -358,46 +459,34 @@ def recipient_request():
     
     recipient_id = session['recipient_id']
     
+    if check_rate_limits(('request_ip', request.remote_addr)):
+        flash('Too many requests, please try again in a few minutes.')
+        return redirect(url_for('recipient_dashboard'))
+    
+    quantity_ml = request.form.get('quantity_ml', type=int)
+    if quantity_ml is None or quantity_ml <= 0:
+        flash('Please enter the quantity in ml as a whole number greater than zero.')
+        return redirect(url_for('recipient_dashboard'))
+    
+    # Check eligibility and stock, allocate units and record the request in one transaction
+    try:
+        allocation = execute_write(record_blood_request, recipient_id, quantity_ml)
+    except WriteTimeoutError as e:
+        when_written(e.future, request_committed)
+        flash('Your request is taking longer than usual to process. Please check your history before trying again.')
+        return redirect(url_for('recipient_dashboard'))
+    
     # Check if recipient can request
-    if not can_recipient_request(recipient_id):
+    if allocation is None:
         flash('You cannot request blood yet. Recipients must wait 40 days between requests.')
         return redirect(url_for('recipient_dashboard'))
     
-    quantity_ml = request.form['quantity_ml']
+    request_committed(allocation)
     
-    # Get recipient's blood type
-    with CursorFromConnectionPool() as cursor:
-        cursor.execute("SELECT blood_type FROM recipients WHERE id = ?", (recipient_id,))
-        blood_type = cursor.fetchone()[0]
-        
-        # Check if blood is available
-        if is_blood_available(blood_type, quantity_ml):
-            # Create blood request entry with status "fulfilled"
-            cursor.execute(
-                "INSERT INTO blood_requests (blood_type, quantity_ml, recipient_id, request_date, status) VALUES (?, ?, ?, ?, ?)",
-                (blood_type, quantity_ml, recipient_id, datetime.date.today(), "fulfilled")
-            )
-            
-            # Update the last request date for the recipient
-            cursor.execute("UPDATE recipients SET last_request_date = ? WHERE id = ?", 
-                          (datetime.date.today(), recipient_id))
-            
-            # Fulfill the request (subtract from blood bank)
-            fulfill_blood_request(blood_type, quantity_ml)
-            
-            flash('Your blood request has been approved and fulfilled!')
-        else:
-            # Create blood request entry with status "pending"
-            cursor.execute(
-                "INSERT INTO blood_requests (blood_type, quantity_ml, recipient_id, request_date, status) VALUES (?, ?, ?, ?, ?)",
-                (blood_type, quantity_ml, recipient_id, datetime.date.today(), "pending")
-            )
-            
-            # Update the last request date for the recipient
-            cursor.execute("UPDATE recipients SET last_request_date = ? WHERE id = ?", 
-                          (datetime.date.today(), recipient_id))
-            
-            flash('Your blood request has been submitted, but insufficient blood is available at the moment.')
+    if allocation.status == 'fulfilled':
+        flash('Your blood request has been approved and fulfilled!')
+    else:
+        flash('Your blood request has been submitted, but insufficient blood is available at the moment.')
     
     return redirect(url_for('recipient_dashboard'))
 
@@ -408,5 +497,109 @@ def recipient_logout():
     flash('You have been logged out')
     return redirect(url_for('home'))
 
+# Read-only JSON API
+def inventory_response(document):
+    """Serve a cached inventory document, answering 304 when the client's copy is current"""
+    response = Response(document.body, mimetype='application/json')
+    response.set_etag(document.etag)
+    response.last_modified = document.last_modified
+    # Clients may keep the document but must revalidate (cheaply) before reuse
+    response.cache_control.public = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+@app.route('/api/inventory')
+def api_inventory():
+    return inventory_response(inventory_document())
+
+@app.route('/api/inventory/<blood_type>')
+def api_inventory_type(blood_type):
+    document = inventory_document(blood_type.upper())
+    if document is None:
+        abort(404)
+    return inventory_response(document)
+
+# Seconds between keepalive comments on an idle event stream, and how long
+# browsers wait before reconnecting a dropped one
+STREAM_KEEPALIVE = float(os.environ.get('BLOOD_BANK_STREAM_KEEPALIVE', 15))
+STREAM_RETRY_MS = 3000
+
+def sse_event(event_id, event, data):
+    return f"id: {event_id}\nevent: {event}\ndata: {data}\n\n"
+
+@app.route('/api/inventory/stream')
+def api_inventory_stream():
+    """Server-sent events: a snapshot, then one event per changed blood type
+
+    ?blood_type= limits the stream to one type. A reconnecting client's
+    Last-Event-ID resumes from the shared buffer; if it is too old the
+    client gets a fresh snapshot instead. Changes made by other worker
+    processes arrive within STREAM_KEEPALIVE seconds.
+    """
+    blood_type = request.args.get('blood_type')
+    blood_type = blood_type.upper() if blood_type else None
+    if blood_type is not None and inventory_document(blood_type) is None:
+        abort(404)
+    last_event_id = request.headers.get('Last-Event-ID', type=int)
+
+    def stream():
+        shard = Database.current_shard()
+        seq = inventory_broker.subscribe(shard)
+        try:
+            inventory_broker.prime(shard)
+            yield f"retry: {STREAM_RETRY_MS}\n\n"
+            resume = last_event_id is not None and last_event_id <= seq
+            after = last_event_id if resume else seq
+            if not resume:
+                yield sse_event(seq, 'snapshot', inventory_document(blood_type).body.decode())
+            while True:
+                events = inventory_broker.wait(after, STREAM_KEEPALIVE)
+                if events is None:
+                    after = inventory_broker.latest
+                    yield sse_event(after, 'snapshot', inventory_document(blood_type).body.decode())
+                    continue
+                if not events:
+                    yield ": keepalive\n\n"
+                    # Pick up stock changed by other worker processes
+                    inventory_broker.refresh(shard, STREAM_KEEPALIVE)
+                    continue
+                for event_seq, event_shard, event_type, data in events:
+                    if event_shard == shard and (blood_type is None or event_type == blood_type):
+                        yield sse_event(event_seq, 'inventory', data)
+                after = events[-1][0]
+        finally:
+            inventory_broker.unsubscribe(shard)
+
+    return Response(stream_with_context(stream()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
+
+# Operational metrics in the Prometheus text format
+@app.route('/metrics')
+def metrics():
+    lines = []
+    for shard in Database.shards():
+        for key, value in Database.pool_stats(shard).items():
+            lines.append(format_sample(f'blood_bank_pool_{key}', value, shard=shard))
+    for name, cache in (('availability', availability_cache), ('snapshot', snapshot_cache)):
+        for key, value in cache.stats().items():
+            lines.append(format_sample(f'blood_bank_cache_{key}', int(value) if isinstance(value, bool) else value, cache=name))
+    lines.append(format_sample('blood_bank_stream_subscribers', inventory_broker.subscribers))
+    lines.append(format_sample('blood_bank_stream_events_total', inventory_broker.published))
+    for name, limiter in rate_limiters.items():
+        stats = limiter.stats()
+        lines.append(format_sample('blood_bank_rate_limit_keys', stats['keys'], limit=name))
+        for key in ('allowed', 'throttled', 'evictions'):
+            lines.append(format_sample(f'blood_bank_rate_limit_{key}_total', stats[key], limit=name))
+    writer = current_writer()
+    if writer is not None:
+        for key, value in writer.stats().items():
+            lines.append(format_sample(f'blood_bank_write_{key}', value))
+    body = '\n'.join(lines) + '\n'
+    if query_stats.enabled:
+        body += query_stats.exposition()
+    return Response(body, mimetype='text/plain; version=0.0.4')
+
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,92 @@
+"""Allocation latency benchmark
+
+Seeds a scratch database with units of every blood type, then times
+allocate_units for random recipient types under each allocation policy
+as the inventory grows. The random case asks for small quantities that
+plentiful stock covers. In the spill-over case a recipient of the one
+scarce type asks for more than that type holds, so allocation has to
+draw from a second compatible type. Every allocation is rolled back, so
+each sample sees the same stock.
+
+Run from the repository root:
+
+    python -m benchmarks.allocation --sizes 1000 10000 100000 200000
+"""
+import argparse
+import datetime
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from compatibility import BLOOD_TYPES
+from database import Database, CursorFromConnectionPool
+from inventory import ALLOCATION_POLICIES, allocate_units, stock_by_type
+
+# Seeded with only a handful of units, for the spill-over case
+SCARCE_TYPE = 'AB-'
+SCARCE_UNITS = 4
+
+
+def seed(units, rng):
+    today = datetime.date.today()
+    plentiful = [t for t in BLOOD_TYPES if t != SCARCE_TYPE]
+    types = [SCARCE_TYPE] * SCARCE_UNITS + [rng.choice(plentiful) for _ in range(units - SCARCE_UNITS)]
+    rows = []
+    for blood_type in types:
+        collected = today - datetime.timedelta(days=rng.randint(0, 41))
+        rows.append((blood_type, rng.choice((250, 450, 500)), None,
+                     collected, collected + datetime.timedelta(days=42)))
+    with CursorFromConnectionPool() as cursor:
+        cursor.executemany(
+            "INSERT INTO blood_bank (blood_type, quantity_ml, donor_id, collection_date, expiry_date) VALUES (?, ?, ?, ?, ?)",
+            rows
+        )
+
+
+def measure(policy, samples, rng, spill_over=False):
+    today = datetime.date.today()
+    with CursorFromConnectionPool() as cursor:
+        scarce_ml = stock_by_type(cursor, [SCARCE_TYPE], today).get(SCARCE_TYPE, 0)
+    timings = []
+    for _ in range(samples):
+        if spill_over:
+            blood_type, quantity_ml = SCARCE_TYPE, scarce_ml + rng.choice((450, 900, 2000))
+        else:
+            blood_type = rng.choice(BLOOD_TYPES)
+            quantity_ml = rng.choice((450, 900, 2000))
+        with CursorFromConnectionPool() as cursor:
+            cursor.execute("BEGIN IMMEDIATE")
+            started = time.perf_counter()
+            allocate_units(cursor, blood_type, quantity_ml, today, policy)
+            timings.append((time.perf_counter() - started) * 1000)
+            cursor.connection.rollback()
+    timings.sort()
+    return {
+        'p50_ms': statistics.median(timings),
+        'p95_ms': timings[int(len(timings) * 0.95) - 1],
+        'max_ms': timings[-1],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000, 200000])
+    parser.add_argument('--samples', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    print(f"{'units':>8} {'policy':<16} {'case':<11} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8}")
+    for size in args.sizes:
+        rng = random.Random(args.seed)
+        Database.initialize(os.path.join(tempfile.mkdtemp(), 'bench.db'))
+        seed(size, rng)
+        for policy in ALLOCATION_POLICIES:
+            for case, spill_over in (('random', False), ('spill-over', True)):
+                r = measure(policy, args.samples, rng, spill_over)
+                print(f"{size:>8} {policy:<16} {case:<11} {r['p50_ms']:>8.3f} {r['p95_ms']:>8.3f} {r['max_ms']:>8.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+"""Concurrent fulfilment benchmark
+
+Seeds a scratch database with blood units and recipients, then lets a
+growing number of threads request blood at the same time. For each level
+of concurrency it reports requests/sec and whether the books still balance:
+the quantity handed out to fulfilled requests must equal the quantity
+removed from blood_bank.
+
+Run from the repository root:
+
+    python -m benchmarks.fulfilment --units 600 --requests 400
+"""
+import argparse
+import datetime
+import os
+import tempfile
+import threading
+import time
+
+from database import Database, CursorFromConnectionPool
+from inventory import fulfill_blood_request
+
+BLOOD_TYPE = 'O+'
+
+
+def seed(units, recipients, unit_ml):
+    today = datetime.date.today()
+    with CursorFromConnectionPool() as cursor:
+        cursor.executemany(
+            "INSERT INTO blood_bank (blood_type, quantity_ml, donor_id, collection_date, expiry_date) VALUES (?, ?, ?, ?, ?)",
+            [(BLOOD_TYPE, unit_ml, None, today - datetime.timedelta(days=i % 30),
+              today + datetime.timedelta(days=12 + i % 30)) for i in range(units)]
+        )
+        cursor.executemany(
+            "INSERT INTO recipients (name, email, password, blood_type, phone, address) VALUES (?, ?, ?, ?, ?, ?)",
+            [(f'r{i}', f'r{i}@example.com', 'x', BLOOD_TYPE, '0', '-') for i in range(recipients)]
+        )
+
+
+def stock_ml():
+    with CursorFromConnectionPool() as cursor:
+        cursor.execute("SELECT COALESCE(SUM(quantity_ml), 0) FROM blood_bank")
+        return cursor.fetchone()[0]
+
+
+def legacy_request(recipient_id, quantity_ml):
+    """The old check / insert / debit sequence, one commit per step"""
+    today = datetime.date.today()
+    with CursorFromConnectionPool() as cursor:
+        cursor.execute("SELECT SUM(quantity_ml) FROM blood_bank WHERE blood_type = ? AND expiry_date > ?",
+                       (BLOOD_TYPE, today))
+        total = cursor.fetchone()[0] or 0
+    status = 'fulfilled' if total >= quantity_ml else 'pending'
+    with CursorFromConnectionPool() as cursor:
+        cursor.execute(
+            "INSERT INTO blood_requests (blood_type, quantity_ml, recipient_id, request_date, status) VALUES (?, ?, ?, ?, ?)",
+            (BLOOD_TYPE, quantity_ml, recipient_id, today, status)
+        )
+    if status != 'fulfilled':
+        return
+    with CursorFromConnectionPool() as cursor:
+        cursor.execute("SELECT id, quantity_ml FROM blood_bank WHERE blood_type = ? AND expiry_date > ? ORDER BY collection_date ASC",
+                       (BLOOD_TYPE, today))
+        remaining = quantity_ml
+        for entry_id, entry_quantity in cursor.fetchall():
+            if remaining < entry_quantity:
+                cursor.execute("UPDATE blood_bank SET quantity_ml = ? WHERE id = ?", (entry_quantity - remaining, entry_id))
+                break
+            cursor.execute("DELETE FROM blood_bank WHERE id = ?", (entry_id,))
+            remaining -= entry_quantity
+            if remaining == 0:
+                break
+
+
+def engine_request(recipient_id, quantity_ml):
+    fulfill_blood_request(recipient_id, quantity_ml)
+
+
+def run(mode, threads, args):
+    path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    Database.initialize(path, pool_size=threads)
+    seed(args.units, args.requests, args.unit_ml)
+    initial = stock_ml()
+
+    handler = engine_request if mode == 'engine' else legacy_request
+    errors = []
+    counter = iter(range(1, args.requests + 1))
+    counter_lock = threading.Lock()
+
+    def worker():
+        while True:
+            with counter_lock:
+                recipient_id = next(counter, None)
+            if recipient_id is None:
+                return
+            try:
+                handler(recipient_id, args.request_ml)
+            except Exception as e:  # keep going, but count it
+                errors.append(e)
+
+    started = time.perf_counter()
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    with CursorFromConnectionPool() as cursor:
+        cursor.execute("SELECT COALESCE(SUM(quantity_ml), 0) FROM blood_requests WHERE status = 'fulfilled'")
+        handed_out = cursor.fetchone()[0]
+    debited = initial - stock_ml()
+
+    return {
+        'mode': mode,
+        'threads': threads,
+        'req_per_sec': args.requests / elapsed,
+        'handed_out_ml': handed_out,
+        'debited_ml': debited,
+        'consistent': handed_out == debited,
+        'errors': len(errors),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--units', type=int, default=600)
+    parser.add_argument('--unit-ml', type=int, default=450)
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--request-ml', type=int, default=1000)
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    parser.add_argument('--modes', nargs='+', default=['legacy', 'engine'], choices=['legacy', 'engine'])
+    args = parser.parse_args()
+
+    print(f"{'mode':<8} {'threads':>7} {'req/s':>9} {'handed out':>11} {'debited':>9} {'ok':>4} {'errors':>6}")
+    for threads in args.threads:
+        for mode in args.modes:
+            r = run(mode, threads, args)
+            print(f"{r['mode']:<8} {r['threads']:>7} {r['req_per_sec']:>9.0f} {r['handed_out_ml']:>11} "
+                  f"{r['debited_ml']:>9} {str(r['consistent']):>4} {r['errors']:>6}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""Login latency under concurrency, inline hashing vs the hashing pool
+
+Seeds a scratch database with donors, then has N threads log in through
+the Flask test client while one more thread polls /api/inventory. Reports
+login throughput and p50/p99 latency, plus the p99 of the cheap route,
+which shows how much hashing starves unrelated requests.
+
+Run from the repository root:
+
+    python -m benchmarks.login --concurrency 1 4 16 --logins 200
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def run(app_module, passwords, workers, concurrency, logins, donors):
+    passwords.configure(workers=workers)
+    latencies = []
+    poll_latencies = []
+    lock = threading.Lock()
+    remaining = iter(range(logins))
+    done = threading.Event()
+
+    def login_worker():
+        client = app_module.app.test_client()
+        while True:
+            with lock:
+                n = next(remaining, None)
+            if n is None:
+                return
+            started = time.perf_counter()
+            response = client.post('/donor/login', data={'email': f'donor{n % donors}@example.com', 'password': 'secret-password'})
+            elapsed = time.perf_counter() - started
+            assert response.status_code == 302, response.status_code
+            with lock:
+                latencies.append(elapsed * 1000)
+
+    def poll_worker():
+        client = app_module.app.test_client()
+        while not done.is_set():
+            started = time.perf_counter()
+            client.get('/api/inventory')
+            poll_latencies.append((time.perf_counter() - started) * 1000)
+            time.sleep(0.005)
+
+    poller = threading.Thread(target=poll_worker)
+    poller.start()
+    started = time.perf_counter()
+    threads = [threading.Thread(target=login_worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    done.set()
+    poller.join()
+
+    return {
+        'logins_per_sec': logins / elapsed,
+        'p50_ms': statistics.median(latencies),
+        'p99_ms': percentile(latencies, 0.99),
+        'poll_p99_ms': percentile(poll_latencies, 0.99) if poll_latencies else float('nan'),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--logins', type=int, default=200)
+    parser.add_argument('--donors', type=int, default=50)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help="hashing processes for the pooled run")
+    args = parser.parse_args()
+
+    # Import the app inside a scratch directory so it never touches a real database
+    os.environ.setdefault('BLOOD_BANK_HOUSEKEEPING_INTERVAL', '0')
+    os.environ.setdefault('BLOOD_BANK_HASH_WORKERS', '0')
+    # Every simulated client shares one address
+    os.environ.setdefault('BLOOD_BANK_RATE_LIMITS', 'off')
+    sys.path.insert(0, REPO_ROOT)
+    os.chdir(tempfile.mkdtemp())
+    import app as app_module
+    import passwords
+    from database import CursorFromConnectionPool
+
+    # Every donor shares one hash so seeding costs a single hashing call
+    password_hash = passwords.hash_password('secret-password')
+    with CursorFromConnectionPool() as cursor:
+        cursor.executemany(
+            "INSERT INTO donors (name, email, password, blood_type, phone, address) VALUES (?, ?, ?, ?, ?, ?)",
+            [(f'Donor {i}', f'donor{i}@example.com', password_hash, 'O+', '0', '-') for i in range(args.donors)]
+        )
+
+    print(f"{'mode':<8} {'threads':>7} {'logins/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'poll p99 ms':>12}")
+    for concurrency in args.concurrency:
+        for mode, workers in (('inline', 0), ('pool', args.workers)):
+            r = run(app_module, passwords, workers, concurrency, args.logins, args.donors)
+            print(f"{mode:<8} {concurrency:>7} {r['logins_per_sec']:>9.1f} {r['p50_ms']:>8.1f} "
+                  f"{r['p99_ms']:>8.1f} {r['poll_p99_ms']:>12.1f}")
+    passwords.configure(workers=0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,316 @@
+"""Load benchmark for the Flask routes
+
+Seeds a scratch blood_bank.db with synthetic donors, recipients, units and
+request history, then drives the real routes through Flask's test client
+from several threads in a weighted mix of operations. Reports throughput,
+p50/p95/p99 latency and SQL statements per request for each operation, and
+writes everything to a JSON file so runs on different commits can be
+compared (--compare prints the change against an earlier file).
+
+Run from the repository root:
+
+    python -m benchmarks.routes --scale 10000 --mix default --requests 2000 --output results.json
+    python -m benchmarks.routes --scale 1000000 --mix browse --compare results.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from jinja2 import FileSystemLoader
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BLOOD_TYPES = ('A+', 'A-', 'B+', 'B-', 'AB+', 'AB-', 'O+', 'O-')
+PASSWORD = 'secret-password'
+
+# Relative weights of each operation
+MIXES = {
+    'default': {'login': 5, 'register': 2, 'donor_dashboard': 25, 'recipient_dashboard': 25,
+                'inventory': 25, 'donate': 10, 'request': 8},
+    'browse': {'login': 5, 'donor_dashboard': 35, 'recipient_dashboard': 35, 'inventory': 25},
+    'write': {'register': 10, 'donate': 45, 'request': 45},
+}
+
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def seed(scale, rng, password_hash, batch_size=10000):
+    """Insert scale units, scale/10 donors and recipients, and scale/10 past requests
+
+    Half of the donors and recipients have no recent donation or request,
+    so they can donate and request during the run.
+    """
+    from database import CursorFromConnectionPool
+
+    today = datetime.date.today()
+    people = max(scale // 10, 100)
+
+    def batches(rows):
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def donors():
+        for i in range(people):
+            last = today - datetime.timedelta(days=rng.randint(0, 30)) if i % 2 else None
+            yield (f'Donor {i}', f'donor{i}@example.com', password_hash, rng.choice(BLOOD_TYPES), '0', '-', last)
+
+    def recipients():
+        for i in range(people):
+            last = today - datetime.timedelta(days=rng.randint(0, 30)) if i % 2 else None
+            yield (f'Recipient {i}', f'recipient{i}@example.com', password_hash, rng.choice(BLOOD_TYPES),
+                   '0', '-', 'none', last)
+
+    def units():
+        for _ in range(scale):
+            collected = today - datetime.timedelta(days=rng.randint(0, 41))
+            yield (rng.choice(BLOOD_TYPES), rng.choice((250, 450, 500)), rng.randint(1, people),
+                   collected, collected + datetime.timedelta(days=42))
+
+    def requests():
+        for _ in range(people):
+            yield (rng.choice(BLOOD_TYPES), rng.choice((250, 450)), rng.randint(1, people),
+                   today - datetime.timedelta(days=rng.randint(0, 365)), 'fulfilled')
+
+    statements = (
+        ("INSERT INTO donors (name, email, password, blood_type, phone, address, last_donation_date) "
+         "VALUES (?, ?, ?, ?, ?, ?, ?)", donors()),
+        ("INSERT INTO recipients (name, email, password, blood_type, phone, address, medical_condition, "
+         "last_request_date) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", recipients()),
+        ("INSERT INTO blood_bank (blood_type, quantity_ml, donor_id, collection_date, expiry_date) "
+         "VALUES (?, ?, ?, ?, ?)", units()),
+        ("INSERT INTO blood_requests (blood_type, quantity_ml, recipient_id, request_date, status) "
+         "VALUES (?, ?, ?, ?, ?)", requests()),
+    )
+    for sql, rows in statements:
+        for batch in batches(rows):
+            with CursorFromConnectionPool() as cursor:
+                cursor.executemany(sql, batch)
+    return people
+
+
+class Workload:
+    """Hands out the ids each operation works on, so no two calls collide"""
+
+    def __init__(self, people, rng):
+        self.people = people
+        self._lock = threading.Lock()
+        self._rng = rng
+        self._registered = 0
+        # Seeded with no recent donation / request (see seed)
+        self._donors = iter(range(1, people + 1, 2))
+        self._recipients = iter(range(1, people + 1, 2))
+
+    def random_person(self):
+        with self._lock:
+            return self._rng.randint(1, self.people)
+
+    def new_email(self):
+        with self._lock:
+            self._registered += 1
+            return f'new{self._registered}@example.com'
+
+    def fresh_donor(self):
+        with self._lock:
+            return next(self._donors, None)
+
+    def fresh_recipient(self):
+        with self._lock:
+            return next(self._recipients, None)
+
+
+def operation(name, client, workload):
+    """Issue one request for operation name; returns the response, or None if nothing is left to do"""
+    if name == 'login':
+        n = workload.random_person() - 1
+        return client.post('/donor/login', data={'email': f'donor{n}@example.com', 'password': PASSWORD})
+    if name == 'register':
+        return client.post('/donor/register', data={
+            'name': 'New donor', 'email': workload.new_email(), 'password': PASSWORD,
+            'blood_type': 'O+', 'phone': '0', 'address': '-',
+        })
+    if name == 'inventory':
+        return client.get('/api/inventory')
+    if name in ('donor_dashboard', 'donate'):
+        donor_id = workload.random_person() if name == 'donor_dashboard' else workload.fresh_donor()
+        if donor_id is None:
+            return None
+        with client.session_transaction() as session:
+            session['donor_id'] = donor_id
+            session['donor_name'] = 'Donor'
+        if name == 'donate':
+            return client.post('/donor/donate', data={'quantity_ml': '450'})
+        return client.get('/donor/dashboard')
+    if name in ('recipient_dashboard', 'request'):
+        recipient_id = workload.random_person() if name == 'recipient_dashboard' else workload.fresh_recipient()
+        if recipient_id is None:
+            return None
+        with client.session_transaction() as session:
+            session['recipient_id'] = recipient_id
+            session['recipient_name'] = 'Recipient'
+        if name == 'request':
+            return client.post('/recipient/request', data={'quantity_ml': '450'})
+        return client.get('/recipient/dashboard')
+    raise ValueError(f"Unknown operation {name!r}")
+
+
+def run(app_module, mix, requests, concurrency, workload, rng):
+    from database import QueryCounter
+
+    names = list(mix)
+    plan = rng.choices(names, weights=[mix[name] for name in names], k=requests)
+    remaining = iter(plan)
+    lock = threading.Lock()
+    samples = {name: [] for name in names}
+    statements = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+
+    def worker():
+        client = app_module.app.test_client()
+        while True:
+            with lock:
+                name = next(remaining, None)
+            if name is None:
+                return
+            with QueryCounter() as counter:
+                started = time.perf_counter()
+                response = operation(name, client, workload)
+                elapsed = time.perf_counter() - started
+            if response is None:
+                continue
+            with lock:
+                if response.status_code >= 400:
+                    errors[name] += 1
+                samples[name].append(elapsed * 1000)
+                statements[name].append(counter.count)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    def summary(latencies, counts, error_count):
+        return {
+            'requests': len(latencies),
+            'errors': error_count,
+            'requests_per_sec': len(latencies) / elapsed,
+            'p50_ms': statistics.median(latencies),
+            'p95_ms': percentile(latencies, 0.95),
+            'p99_ms': percentile(latencies, 0.99),
+            'sql_per_request': statistics.mean(counts),
+        }
+
+    results = {name: summary(samples[name], statements[name], errors[name]) for name in names if samples[name]}
+    results['all'] = summary([s for name in names for s in samples[name]],
+                             [s for name in names for s in statements[name]], sum(errors.values()))
+    return elapsed, results
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results, baseline=None):
+    print(f"{'operation':<20} {'requests':>8} {'errors':>6} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'p99 ms':>8} {'SQL/req':>8}")
+    for name, r in results.items():
+        print(f"{name:<20} {r['requests']:>8} {r['errors']:>6} {r['requests_per_sec']:>9.1f} {r['p50_ms']:>8.2f} "
+              f"{r['p95_ms']:>8.2f} {r['p99_ms']:>8.2f} {r['sql_per_request']:>8.1f}")
+        old = (baseline or {}).get(name)
+        if old:
+            change = {key: (r[key] - old[key]) / old[key] * 100 if old[key] else 0.0
+                      for key in ('requests_per_sec', 'p50_ms', 'p95_ms', 'p99_ms', 'sql_per_request')}
+            print(f"{'  vs baseline':<20} {'':>8} {'':>6} {change['requests_per_sec']:>+8.1f}% "
+                  f"{change['p50_ms']:>+7.1f}% {change['p95_ms']:>+7.1f}% {change['p99_ms']:>+7.1f}% "
+                  f"{change['sql_per_request']:>+7.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', type=int, default=10000, help="blood units to seed (10000 to 1000000)")
+    parser.add_argument('--mix', choices=sorted(MIXES), default='default')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--hash-method', default='pbkdf2:sha256:1000',
+                        help="password hash for the run; a cheap one keeps logins from dominating")
+    parser.add_argument('--output', help="write results to this JSON file")
+    parser.add_argument('--compare', help="print changes against an earlier JSON results file")
+    args = parser.parse_args()
+
+    if args.output:
+        args.output = os.path.abspath(args.output)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+
+    # Import the app inside a scratch directory so it never touches a real database
+    os.environ.setdefault('BLOOD_BANK_HOUSEKEEPING_INTERVAL', '0')
+    os.environ.setdefault('BLOOD_BANK_HASH_WORKERS', '0')
+    # Every simulated client shares one address
+    os.environ.setdefault('BLOOD_BANK_RATE_LIMITS', 'off')
+    os.environ['BLOOD_BANK_PASSWORD_HASH'] = args.hash_method
+    sys.path.insert(0, REPO_ROOT)
+    os.chdir(tempfile.mkdtemp())
+    import app as app_module
+    import passwords
+    if not os.path.isdir(os.path.join(REPO_ROOT, 'templates')):
+        # Checkouts keep the templates next to the modules
+        app_module.app.jinja_loader = FileSystemLoader(REPO_ROOT)
+        app_module.precompile_templates()
+
+    rng = random.Random(args.seed)
+    started = time.perf_counter()
+    people = seed(args.scale, rng, passwords.hash_password(PASSWORD))
+    seed_seconds = time.perf_counter() - started
+    print(f"Seeded {args.scale} units, {people} donors and {people} recipients in {seed_seconds:.1f}s")
+
+    elapsed, results = run(app_module, MIXES[args.mix], args.requests, args.concurrency,
+                           Workload(people, rng), rng)
+    print_results(results, baseline)
+
+    if args.output:
+        report = {
+            'revision': git_revision(),
+            'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'settings': vars(args),
+            'people': people,
+            'seed_seconds': seed_seconds,
+            'elapsed_seconds': elapsed,
+            'results': results,
+        }
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
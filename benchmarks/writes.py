@@ -0,0 +1,141 @@
+"""Donation and request write throughput, per-request commits vs group commit
+
+Seeds a scratch database with donors, recipients and stock, then has N
+threads record donations and blood requests through the same write
+functions the routes use. Each level of concurrency runs once with every
+write committing on its own and once through the group-commit writer.
+Reports writes/sec, p50/p99 latency and, for the batched runs, the mean
+number of writes per commit.
+
+Run from the repository root:
+
+    python -m benchmarks.writes --threads 1 4 16 --writes 2000
+    python -m benchmarks.writes --threads 16 --delay-ms 0 1 5 --synchronous normal
+"""
+import argparse
+import datetime
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BLOOD_TYPE = 'O+'
+
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def seed(people, units):
+    from database import CursorFromConnectionPool
+
+    today = datetime.date.today()
+    with CursorFromConnectionPool() as cursor:
+        cursor.executemany(
+            "INSERT INTO donors (name, email, password, blood_type, phone, address) VALUES (?, ?, ?, ?, ?, ?)",
+            [(f'Donor {i}', f'donor{i}@example.com', 'x', BLOOD_TYPE, '0', '-') for i in range(people)]
+        )
+        cursor.executemany(
+            "INSERT INTO recipients (name, email, password, blood_type, phone, address) VALUES (?, ?, ?, ?, ?, ?)",
+            [(f'Recipient {i}', f'recipient{i}@example.com', 'x', BLOOD_TYPE, '0', '-') for i in range(people)]
+        )
+        cursor.executemany(
+            "INSERT INTO blood_bank (blood_type, quantity_ml, donor_id, collection_date, expiry_date) VALUES (?, ?, ?, ?, ?)",
+            [(BLOOD_TYPE, 450, None, today, today + datetime.timedelta(days=42)) for _ in range(units)]
+        )
+
+
+def run(app_module, batched, threads, delay_ms, args):
+    from database import Database
+    from inventory import record_blood_request
+    import writer
+
+    # Every run gets a fresh database, so donors are eligible again
+    Database.initialize(os.path.join(tempfile.mkdtemp(), 'bench.db'), pool_size=threads + 1)
+    if args.synchronous:
+        # Open every pooled connection at once so each gets the setting
+        connections = [Database.get_connection() for _ in range(threads + 1)]
+        for connection in connections:
+            connection.execute(f"PRAGMA synchronous = {args.synchronous}")
+            Database.release_connection(connection)
+    seed(args.writes, args.writes)
+    writer.configure(enabled=batched, max_batch=args.batch_size, max_delay=delay_ms / 1000.0)
+
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    remaining = iter(range(1, args.writes + 1))
+
+    def worker():
+        while True:
+            with lock:
+                n = next(remaining, None)
+            if n is None:
+                return
+            started = time.perf_counter()
+            try:
+                if n % 2:
+                    writer.execute(app_module.record_donation, n, 450)
+                else:
+                    writer.execute(record_blood_request, n, 450)
+            except Exception as e:  # keep going, but count it
+                errors.append(e)
+                continue
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed * 1000)
+
+    started = time.perf_counter()
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    stats = writer.current_writer().stats() if batched else None
+    writer.configure(enabled=False)
+    return {
+        'writes_per_sec': len(latencies) / elapsed,
+        'p50_ms': statistics.median(latencies),
+        'p99_ms': percentile(latencies, 0.99),
+        'per_commit': stats['operations'] / stats['batches'] if stats and stats['batches'] else 1.0,
+        'errors': len(errors),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--writes', type=int, default=2000, help="writes per run, half donations and half requests")
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--delay-ms', type=float, nargs='+', default=[0.0, 2.0],
+                        help="group-commit deadlines to try")
+    parser.add_argument('--synchronous', choices=['off', 'normal', 'full'],
+                        help="PRAGMA synchronous for the run (default: the connection's own)")
+    args = parser.parse_args()
+
+    # Import the app inside a scratch directory so it never touches a real database
+    os.environ.setdefault('BLOOD_BANK_HOUSEKEEPING_INTERVAL', '0')
+    os.environ.setdefault('BLOOD_BANK_HASH_WORKERS', '0')
+    os.environ['BLOOD_BANK_WRITE_BATCHING'] = 'off'
+    sys.path.insert(0, REPO_ROOT)
+    os.chdir(tempfile.mkdtemp())
+    import app as app_module
+
+    print(f"{'mode':<14} {'threads':>7} {'writes/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'per commit':>10} {'errors':>6}")
+    for threads in args.threads:
+        runs = [('per-request', False, 0.0)] + [(f'batched {d:g}ms', True, d) for d in args.delay_ms]
+        for mode, batched, delay_ms in runs:
+            r = run(app_module, batched, threads, delay_ms, args)
+            print(f"{mode:<14} {threads:>7} {r['writes_per_sec']:>9.0f} {r['p50_ms']:>8.2f} {r['p99_ms']:>8.2f} "
+                  f"{r['per_commit']:>10.1f} {r['errors']:>6}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+"""Streaming bulk import of donations and export of inventory tables
+
+Both directions work on CSV or JSON Lines and never hold more than one
+batch of rows in memory.
+"""
+from database import CursorFromConnectionPool
+from inventory import invalidate_availability
+from repositories import DONATION_INTERVAL_DAYS, DONATION_MAX_ML, DONATION_MIN_ML, SHELF_LIFE_DAYS
+import csv
+import datetime
+import json
+
+EXPORT_TABLES = {
+    'blood_bank': ('id', 'blood_type', 'quantity_ml', 'donor_id', 'collection_date', 'expiry_date'),
+    'blood_bank_expired': ('id', 'blood_type', 'quantity_ml', 'donor_id', 'collection_date', 'expiry_date'),
+    'blood_requests': ('id', 'blood_type', 'quantity_ml', 'recipient_id', 'request_date', 'status'),
+}
+
+
+def guess_format(path, default='csv'):
+    if path.endswith(('.jsonl', '.ndjson', '.json')):
+        return 'jsonl'
+    if path.endswith('.csv'):
+        return 'csv'
+    return default
+
+
+def read_records(stream, fmt):
+    """Yield one dict per input record"""
+    if fmt == 'jsonl':
+        for line in stream:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+    else:
+        yield from csv.DictReader(stream)
+
+
+def write_records(stream, fmt, columns, rows):
+    """Write row tuples as CSV (with a header) or JSON Lines"""
+    if fmt == 'jsonl':
+        for row in rows:
+            stream.write(json.dumps(dict(zip(columns, row))))
+            stream.write('\n')
+    else:
+        writer = csv.writer(stream)
+        writer.writerow(columns)
+        writer.writerows(rows)
+
+
+def _batches(records, size):
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _parse_donation(record, today):
+    """Validate one input record, returning (donor_id, quantity_ml, collection_date)"""
+    donor_id = int(record['donor_id'])
+    quantity_ml = int(record['quantity_ml'])
+    if not DONATION_MIN_ML <= quantity_ml <= DONATION_MAX_ML:
+        raise ValueError(f"quantity_ml {quantity_ml} outside {DONATION_MIN_ML}-{DONATION_MAX_ML}")
+    collection_date = record.get('collection_date')
+    collection_date = datetime.date.fromisoformat(collection_date) if collection_date else today
+    if collection_date > today:
+        raise ValueError(f"collection_date {collection_date} is in the future")
+    return donor_id, quantity_ml, collection_date
+
+
+def import_donations(records, batch_size=1000, on_reject=None):
+    """Record donations from an iterable of dicts, one transaction per batch
+
+    Each record needs donor_id and quantity_ml, and may give collection_date
+    (YYYY-MM-DD, default today). Donors are looked up once per batch;
+    records for unknown donors, or within DONATION_INTERVAL_DAYS of the
+    donor's previous donation (including earlier records in the same
+    import), are rejected through on_reject(line_number, record, reason).
+    Returns (imported, rejected).
+    """
+    today = datetime.date.today()
+    imported = rejected = 0
+    touched_types = set()
+
+    def reject(line_number, record, reason):
+        nonlocal rejected
+        rejected += 1
+        if on_reject:
+            on_reject(line_number, record, reason)
+
+    for batch in _batches(enumerate(records, 1), batch_size):
+        parsed = []
+        for line_number, record in batch:
+            try:
+                parsed.append((line_number, record) + _parse_donation(record, today))
+            except (KeyError, TypeError, ValueError) as e:
+                reject(line_number, record, f"invalid record: {e}")
+
+        donor_ids = sorted({row[2] for row in parsed})
+        if not donor_ids:
+            continue
+
+        with CursorFromConnectionPool() as cursor:
+            cursor.execute("BEGIN IMMEDIATE")
+            placeholders = ','.join('?' * len(donor_ids))
+            cursor.execute(f"SELECT id, blood_type, last_donation_date FROM donors WHERE id IN ({placeholders})",
+                           donor_ids)
+            donors = {
+                donor_id: [blood_type, datetime.date.fromisoformat(last) if last else None]
+                for donor_id, blood_type, last in cursor.fetchall()
+            }
+
+            units = []
+            last_donations = {}
+            for line_number, record, donor_id, quantity_ml, collection_date in sorted(parsed, key=lambda row: row[4]):
+                donor = donors.get(donor_id)
+                if donor is None:
+                    reject(line_number, record, f"unknown donor {donor_id}")
+                    continue
+                blood_type, last_donation = donor
+                if last_donation and (collection_date - last_donation).days < DONATION_INTERVAL_DAYS:
+                    reject(line_number, record, f"donor {donor_id} last donated on {last_donation}")
+                    continue
+                donor[1] = last_donations[donor_id] = collection_date
+                units.append((blood_type, quantity_ml, donor_id, collection_date,
+                              collection_date + datetime.timedelta(days=SHELF_LIFE_DAYS)))
+                touched_types.add(blood_type)
+
+            cursor.executemany(
+                "INSERT INTO blood_bank (blood_type, quantity_ml, donor_id, collection_date, expiry_date) VALUES (?, ?, ?, ?, ?)",
+                units
+            )
+            cursor.executemany(
+                "UPDATE donors SET last_donation_date = ? WHERE id = ?",
+                [(last_donation, donor_id) for donor_id, last_donation in last_donations.items()]
+            )
+        imported += len(units)
+
+    if touched_types:
+        invalidate_availability(*touched_types)
+    return imported, rejected
+
+
+def export_rows(table, batch_size=1000):
+    """Yield every row of an EXPORT_TABLES table in id order"""
+    columns = EXPORT_TABLES[table]
+    with CursorFromConnectionPool() as cursor:
+        cursor.execute(f"SELECT {', '.join(columns)} FROM {table} ORDER BY id")
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield from rows
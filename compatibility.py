@@ -0,0 +1,56 @@
+"""ABO/Rh red cell compatibility, precomputed once at import"""
+
+BLOOD_TYPES = ('O-', 'O+', 'A-', 'A+', 'B-', 'B+', 'AB-', 'AB+')
+
+
+def _can_receive(recipient_type, donor_type):
+    """Red cells are compatible if they carry no antigen the recipient lacks"""
+    recipient_abo, recipient_rh = recipient_type[:-1], recipient_type[-1]
+    donor_abo, donor_rh = donor_type[:-1], donor_type[-1]
+
+    donor_antigens = set(donor_abo) - {'O'}
+    recipient_antigens = set(recipient_abo) - {'O'}
+    if not donor_antigens <= recipient_antigens:
+        return False
+    return donor_rh == '-' or recipient_rh == '+'
+
+
+# COMPATIBILITY[recipient][donor] -> bool, the full 8x8 table
+COMPATIBILITY = {
+    recipient: {donor: _can_receive(recipient, donor) for donor in BLOOD_TYPES}
+    for recipient in BLOOD_TYPES
+}
+
+# Donor types each recipient type can take, and the reverse
+COMPATIBLE_DONORS = {
+    recipient: tuple(donor for donor in BLOOD_TYPES if COMPATIBILITY[recipient][donor])
+    for recipient in BLOOD_TYPES
+}
+COMPATIBLE_RECIPIENTS = {
+    donor: tuple(recipient for recipient in BLOOD_TYPES if COMPATIBILITY[recipient][donor])
+    for donor in BLOOD_TYPES
+}
+
+
+def compatible_donors(recipient_type):
+    """Donor types that can give to recipient_type; unknown types match only themselves"""
+    return COMPATIBLE_DONORS.get(recipient_type, (recipient_type,))
+
+
+def compatible_recipients(donor_type):
+    """Recipient types that can take donor_type; unknown types match only themselves"""
+    return COMPATIBLE_RECIPIENTS.get(donor_type, (donor_type,))
+
+
+def preference_order(recipient_type, stock_ml):
+    """Donor types to draw from, best first
+
+    The recipient's own type comes first. The remaining compatible types
+    follow from most to least plentiful in stock_ml (a {blood_type: ml}
+    mapping), so the scarcest compatible stock is used last. Ties go to the
+    type that serves the fewest recipient types, then to the later one in
+    BLOOD_TYPES, so O- is drawn last and O+ just before it.
+    """
+    others = [t for t in compatible_donors(recipient_type) if t != recipient_type]
+    others.sort(key=lambda t: (-stock_ml.get(t, 0), len(compatible_recipients(t)), -BLOOD_TYPES.index(t)))
+    return [recipient_type] + others
@@ -0,0 +1,191 @@
+"""Conformance checks for storage backends
+
+run_conformance(backend) exercises a backend the way the application uses
+it: schema setup, the repositories, transactions, allocation, sweeping and,
+for layouts with several shards, isolation between shards and independent
+write locks. Every check runs on every shard. Point it at scratch storage
+only; it writes test rows.
+
+    python manage.py check-storage --shards north,south
+"""
+from database import MIGRATIONS, CursorFromConnectionPool, Database
+from housekeeping import sweep_expired_units
+from inventory import fulfill_blood_request, rebuild_inventory_summary, stock_by_type
+from repositories import DonorRepo, InventoryRepo, RecipientRepo
+import datetime
+import sqlite3
+import threading
+import time
+
+BLOOD_TYPE = 'O-'
+
+
+class ConformanceError(AssertionError):
+    """A backend behaved differently from the reference SQLite layout"""
+
+
+def expect(condition, message):
+    if not condition:
+        raise ConformanceError(message)
+
+
+def stock_ml():
+    with CursorFromConnectionPool() as cursor:
+        return stock_by_type(cursor, [BLOOD_TYPE]).get(BLOOD_TYPE, 0)
+
+
+def check_schema(shard):
+    with CursorFromConnectionPool() as cursor:
+        cursor.execute("PRAGMA user_version")
+        version = cursor.fetchone()[0]
+        cursor.execute("PRAGMA journal_mode")
+        journal_mode = cursor.fetchone()[0]
+    expect(version == MIGRATIONS[-1][0], f"schema version {version}, expected {MIGRATIONS[-1][0]}")
+    expect(journal_mode.lower() == 'wal', f"journal mode {journal_mode}, expected wal")
+
+
+def check_generated_ids(shard):
+    with CursorFromConnectionPool() as cursor:
+        donor_id = DonorRepo.create(cursor, 'Check', f'ids@{shard}', 'x', BLOOD_TYPE, '0', '-')
+        found = DonorRepo.find_login(cursor, f'ids@{shard}')
+        unit_id = InventoryRepo.add_unit(cursor, BLOOD_TYPE, 100, donor_id)
+        cursor.execute("SELECT donor_id FROM blood_bank WHERE id = ?", (unit_id,))
+        unit = cursor.fetchone()
+    expect(found is not None and found[0] == donor_id, "create did not return the new donor's id")
+    expect(unit is not None and unit[0] == donor_id, "add_unit did not return the new unit's id")
+
+
+def check_rollback(shard):
+    try:
+        with CursorFromConnectionPool() as cursor:
+            DonorRepo.create(cursor, 'Check', f'rollback@{shard}', 'x', BLOOD_TYPE, '0', '-')
+            raise RuntimeError("abort")
+    except RuntimeError:
+        pass
+    with CursorFromConnectionPool() as cursor:
+        expect(DonorRepo.find_login(cursor, f'rollback@{shard}') is None, "a failed block was committed")
+
+
+def check_nested_blocks(shard):
+    with CursorFromConnectionPool() as outer:
+        with CursorFromConnectionPool() as inner:
+            expect(inner.connection is outer.connection, "nested blocks did not share a connection")
+
+
+def check_summary_triggers(shard):
+    before = stock_ml()
+    with CursorFromConnectionPool() as cursor:
+        InventoryRepo.add_unit(cursor, BLOOD_TYPE, 450, None)
+    expect(stock_ml() == before + 450, "inventory_summary did not follow an insert")
+    expect(not rebuild_inventory_summary(), "inventory_summary drifted from blood_bank")
+
+
+def check_flow_triggers(shard):
+    def flows():
+        with CursorFromConnectionPool() as cursor:
+            cursor.execute("SELECT donated_ml, issued_ml FROM daily_stock_flows WHERE day = ? AND blood_type = ?",
+                           (datetime.date.today().isoformat(), BLOOD_TYPE))
+            return cursor.fetchone() or (0, 0)
+
+    donated, issued = flows()
+    with CursorFromConnectionPool() as cursor:
+        unit_id = InventoryRepo.add_unit(cursor, BLOOD_TYPE, 450, None)
+        cursor.execute("DELETE FROM blood_bank WHERE id = ?", (unit_id,))
+    expect(flows() == (donated + 450, issued + 450), "daily_stock_flows did not follow an insert and a delete")
+
+
+def check_allocation(shard):
+    with CursorFromConnectionPool() as cursor:
+        recipient_id = RecipientRepo.create(cursor, 'Check', f'allocation@{shard}', 'x', BLOOD_TYPE, '0', '-', None)
+        for _ in range(3):
+            InventoryRepo.add_unit(cursor, BLOOD_TYPE, 300, None)
+    before = stock_ml()
+    allocation = fulfill_blood_request(recipient_id, 700)
+    expect(allocation.status == 'fulfilled', f"request was {allocation.status}")
+    expect(stock_ml() == before - 700, "allocation did not debit exactly the requested amount")
+    expect(not rebuild_inventory_summary(), "inventory_summary drifted after allocation")
+
+
+def check_sweep(shard):
+    collected = datetime.date.today() - datetime.timedelta(days=100)
+    with CursorFromConnectionPool() as cursor:
+        unit_id = InventoryRepo.add_unit(cursor, BLOOD_TYPE, 200, None, collection_date=collected)
+    sweep_expired_units()
+    with CursorFromConnectionPool() as cursor:
+        cursor.execute("SELECT COUNT(*) FROM blood_bank WHERE id = ?", (unit_id,))
+        live = cursor.fetchone()[0]
+        cursor.execute("SELECT COUNT(*) FROM blood_bank_expired WHERE id = ?", (unit_id,))
+        archived = cursor.fetchone()[0]
+    expect(live == 0 and archived == 1, "expired unit was not archived")
+
+
+def check_shard_isolation(shard, other):
+    with Database.use_shard(other):
+        before = stock_ml()
+    with CursorFromConnectionPool() as cursor:
+        InventoryRepo.add_unit(cursor, BLOOD_TYPE, 450, None)
+    with Database.use_shard(other):
+        expect(stock_ml() == before, f"a unit added in {shard} showed up in {other}")
+
+
+def check_cross_shard_transaction(shard, other):
+    with CursorFromConnectionPool():
+        with Database.use_shard(other):
+            try:
+                with CursorFromConnectionPool():
+                    pass
+            except sqlite3.ProgrammingError:
+                return
+    raise ConformanceError("a transaction was allowed to span shards")
+
+
+def check_independent_writers(shard, other):
+    locked = threading.Event()
+    release = threading.Event()
+
+    def hold_write_lock():
+        with Database.use_shard(shard):
+            with CursorFromConnectionPool() as cursor:
+                cursor.execute("BEGIN IMMEDIATE")
+                locked.set()
+                release.wait(10)
+
+    holder = threading.Thread(target=hold_write_lock)
+    holder.start()
+    try:
+        locked.wait(10)
+        started = time.perf_counter()
+        with Database.use_shard(other):
+            with CursorFromConnectionPool() as cursor:
+                cursor.execute("BEGIN IMMEDIATE")
+                InventoryRepo.add_unit(cursor, BLOOD_TYPE, 100, None)
+        waited = time.perf_counter() - started
+    finally:
+        release.set()
+        holder.join()
+    expect(waited < 1.0, f"a write in {other} waited {waited:.1f}s on a transaction in {shard}")
+
+
+CHECKS = [check_schema, check_generated_ids, check_rollback, check_nested_blocks,
+          check_summary_triggers, check_flow_triggers, check_allocation, check_sweep]
+SHARD_CHECKS = [check_shard_isolation, check_cross_shard_transaction, check_independent_writers]
+
+
+def run_conformance(backend):
+    """Initialize Database on backend and yield (check name, error or None) for every check"""
+    Database.initialize(backend=backend, pool_size=4, pool_timeout=5.0)
+    shards = Database.shards()
+    for shard in shards:
+        others = [other for other in shards if other != shard]
+        runs = [(check, ()) for check in CHECKS]
+        if others:
+            runs += [(check, (others[0],)) for check in SHARD_CHECKS]
+        for check, extra in runs:
+            name = f"{check.__name__[len('check_'):]} [{shard}]"
+            try:
+                with Database.use_shard(shard):
+                    check(shard, *extra)
+            except Exception as e:
+                yield name, e
+            else:
+                yield name, None
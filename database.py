@@ -1,18 +1,543 @@
+from contextlib import contextmanager
+from functools import partial
+from metrics import query_stats
+import os
+import queue
+import re
 import sqlite3
+import threading
+import time
+
+
+class PoolTimeoutError(sqlite3.OperationalError):
+    """Raised when no pooled connection becomes free within the pool timeout"""
+
+
+_TRANSACTION_CONTROL = frozenset(('BEGIN', 'COMMIT', 'END', 'ROLLBACK'))
+
+
+class QueryCounter:
+    """Counts SQL statements executed on the current thread while active
+
+        with QueryCounter() as counter:
+            ...
+        counter.count
+
+    Counts statements run through cursors handed out by
+    CursorFromConnectionPool; transaction control (BEGIN, COMMIT, ROLLBACK)
+    and statements run by triggers are not counted.
+    """
+    _local = threading.local()
+
+    def __init__(self):
+        self.count = 0
+        self._outer = None
+
+    def __enter__(self):
+        self._outer = getattr(self._local, 'counter', None)
+        self._local.counter = self
+        return self
+
+    def __exit__(self, exception_type, exception_value, exception_traceback):
+        self._local.counter = self._outer
+        if self._outer is not None:
+            self._outer.count += self.count
 
-class Database:
-    """Database connection manager class"""
-    __connection_pool = None
-    
     @classmethod
-    def initialize(cls):
-        """Initialize the database connection pool"""
-        cls.__connection_pool = sqlite3.connect('blood_bank.db', check_same_thread=False)
-        
-        # Create tables if they don't exist
-        with cls.__connection_pool as connection:
+    def record(cls, statement):
+        counter = getattr(cls._local, 'counter', None)
+        if counter is None:
+            return
+        if statement.split(None, 1)[0].upper() in _TRANSACTION_CONTROL:
+            return
+        counter.count += 1
+
+
+class CountingCursor(sqlite3.Cursor):
+    """Cursor that reports each statement to the active QueryCounter"""
+    def execute(self, sql, parameters=()):
+        QueryCounter.record(sql)
+        return super().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        QueryCounter.record(sql)
+        return super().executemany(sql, seq_of_parameters)
+
+
+class InstrumentedCursor(CountingCursor):
+    """Counting cursor that also reports timings and row counts to query_stats
+
+    A statement's latency covers its execute call and every fetch of its
+    rows; it is recorded when the next statement starts or the cursor is
+    closed.
+    """
+    _sql = None
+
+    def _finish(self):
+        if self._sql is None:
+            return
+        rows = self._rows if self.rowcount == -1 else self.rowcount
+        query_stats.record_statement(self._sql, self._elapsed, rows)
+        self._sql = None
+
+    def _run(self, run, sql, parameters):
+        self._finish()
+        started = time.perf_counter()
+        try:
+            result = run(sql, parameters)
+        except sqlite3.OperationalError as e:
+            if 'locked' in str(e) or 'busy' in str(e):
+                query_stats.record_busy()
+            raise
+        elapsed = time.perf_counter() - started
+        if sql.lstrip()[:5].upper() == 'BEGIN':
+            # Waiting for the write lock is what a BEGIN IMMEDIATE spends its time on
+            query_stats.record_lock_wait(elapsed)
+            return result
+        self._sql, self._elapsed, self._rows = sql, elapsed, 0
+        return result
+
+    def execute(self, sql, parameters=()):
+        return self._run(super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._run(super().executemany, sql, seq_of_parameters)
+
+    def _fetch(self, fetch, *args):
+        started = time.perf_counter()
+        result = fetch(*args)
+        if self._sql is not None:
+            self._elapsed += time.perf_counter() - started
+            self._rows += len(result) if isinstance(result, list) else result is not None
+        return result
+
+    def fetchone(self):
+        return self._fetch(super().fetchone)
+
+    def fetchmany(self, size=None):
+        return self._fetch(super().fetchmany, self.arraysize if size is None else size)
+
+    def fetchall(self):
+        return self._fetch(super().fetchall)
+
+    def __next__(self):
+        row = self.fetchone()
+        if row is None:
+            raise StopIteration
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+
+class ConnectionPool:
+    """Bounded pool of connections handed out by checkout/checkin
+
+    connect() is called to open each new connection.
+    """
+    def __init__(self, connect, max_size=8, timeout=30.0):
+        self.connect = connect
+        self.max_size = max_size
+        self.timeout = timeout
+
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._closed = False
+
+        # Pool-wait metrics
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._max_wait = 0.0
+        self._timeouts = 0
+
+    def checkout(self):
+        """Take a connection from the pool, opening one if below max_size"""
+        if self._closed:
+            raise sqlite3.ProgrammingError("Connection pool is closed")
+
+        try:
+            connection = self._idle.get_nowait()
+        except queue.Empty:
+            connection = None
+
+        if connection is None:
+            with self._lock:
+                can_create = self._created < self.max_size
+                if can_create:
+                    self._created += 1
+            if can_create:
+                try:
+                    connection = self.connect()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+
+        if connection is None:
+            # Pool exhausted: wait for another thread to check a connection in
+            started = time.perf_counter()
+            try:
+                connection = self._idle.get(timeout=self.timeout)
+            except queue.Empty:
+                with self._lock:
+                    self._timeouts += 1
+                raise PoolTimeoutError(
+                    f"No database connection available after {self.timeout}s "
+                    f"(pool size {self.max_size})"
+                )
+            waited = time.perf_counter() - started
+            with self._lock:
+                self._waits += 1
+                self._wait_time += waited
+                self._max_wait = max(self._max_wait, waited)
+
+        with self._lock:
+            self._checkouts += 1
+        return connection
+
+    def checkin(self, connection):
+        """Return a connection to the pool"""
+        if connection.in_transaction:
+            # Never hand a half-finished transaction to the next caller
+            connection.rollback()
+
+        if self._closed:
+            connection.close()
+            with self._lock:
+                self._created -= 1
+            return
+
+        self._idle.put(connection)
+
+    def close(self):
+        """Close every idle connection; busy ones are closed on checkin"""
+        self._closed = True
+        while True:
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            connection.close()
+            with self._lock:
+                self._created -= 1
+
+    def stats(self):
+        """Snapshot of pool size and pool-wait metrics"""
+        with self._lock:
+            return {
+                'max_size': self.max_size,
+                'open': self._created,
+                'idle': self._idle.qsize(),
+                'checkouts': self._checkouts,
+                'waits': self._waits,
+                'wait_time_total': self._wait_time,
+                'wait_time_max': self._max_wait,
+                'timeouts': self._timeouts,
+            }
+
+
+# Schema migrations, applied in order on top of the base tables created in
+# SQLiteBackend.create_schema. PRAGMA user_version records the last one applied, so
+# new entries must only ever be appended.
+MIGRATIONS = [
+    # 1: indexes for the hot lookup paths
+    (1, [
+        # FIFO allocation: WHERE blood_type = ? AND expiry_date > ? ORDER BY collection_date
+        """CREATE INDEX IF NOT EXISTS idx_blood_bank_type_collection
+           ON blood_bank (blood_type, collection_date, expiry_date, quantity_ml)""",
+        # Availability totals: SUM(quantity_ml) WHERE blood_type = ? AND expiry_date > ?
+        """CREATE INDEX IF NOT EXISTS idx_blood_bank_type_expiry
+           ON blood_bank (blood_type, expiry_date, quantity_ml)""",
+        # Donation history: WHERE donor_id = ? ORDER BY collection_date
+        """CREATE INDEX IF NOT EXISTS idx_blood_bank_donor
+           ON blood_bank (donor_id, collection_date)""",
+        # Request history: WHERE recipient_id = ? ORDER BY request_date
+        """CREATE INDEX IF NOT EXISTS idx_blood_requests_recipient
+           ON blood_requests (recipient_id, request_date)""",
+    ]),
+    # 2: per-blood-type inventory summary kept current by triggers, so every
+    # writer of blood_bank (routes, imports, sweeps) maintains it
+    (2, [
+        """CREATE TABLE IF NOT EXISTS inventory_summary (
+               blood_type TEXT PRIMARY KEY,
+               total_ml INTEGER NOT NULL DEFAULT 0,
+               unit_count INTEGER NOT NULL DEFAULT 0,
+               earliest_expiry TEXT
+           )""",
+        """CREATE TRIGGER IF NOT EXISTS trg_blood_bank_summary_insert
+           AFTER INSERT ON blood_bank
+           BEGIN
+               INSERT INTO inventory_summary (blood_type, total_ml, unit_count, earliest_expiry)
+               VALUES (NEW.blood_type, NEW.quantity_ml, 1, NEW.expiry_date)
+               ON CONFLICT (blood_type) DO UPDATE SET
+                   total_ml = total_ml + excluded.total_ml,
+                   unit_count = unit_count + 1,
+                   earliest_expiry = MIN(COALESCE(earliest_expiry, excluded.earliest_expiry),
+                                         excluded.earliest_expiry);
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_blood_bank_summary_delete
+           AFTER DELETE ON blood_bank
+           BEGIN
+               UPDATE inventory_summary SET
+                   total_ml = total_ml - OLD.quantity_ml,
+                   unit_count = unit_count - 1,
+                   earliest_expiry = CASE
+                       WHEN OLD.expiry_date <= earliest_expiry
+                       THEN (SELECT MIN(expiry_date) FROM blood_bank WHERE blood_type = OLD.blood_type)
+                       ELSE earliest_expiry
+                   END
+               WHERE blood_type = OLD.blood_type;
+           END""",
+        # Partial draws only change the quantity of a unit
+        """CREATE TRIGGER IF NOT EXISTS trg_blood_bank_summary_quantity
+           AFTER UPDATE OF quantity_ml ON blood_bank
+           WHEN OLD.blood_type = NEW.blood_type AND OLD.expiry_date = NEW.expiry_date
+           BEGIN
+               UPDATE inventory_summary SET total_ml = total_ml - OLD.quantity_ml + NEW.quantity_ml
+               WHERE blood_type = OLD.blood_type;
+           END""",
+        # Anything else is treated as removing the old unit and adding the new one
+        """CREATE TRIGGER IF NOT EXISTS trg_blood_bank_summary_move
+           AFTER UPDATE OF blood_type, expiry_date ON blood_bank
+           WHEN OLD.blood_type IS NOT NEW.blood_type OR OLD.expiry_date IS NOT NEW.expiry_date
+           BEGIN
+               UPDATE inventory_summary SET
+                   total_ml = total_ml - OLD.quantity_ml,
+                   unit_count = unit_count - 1,
+                   earliest_expiry = (SELECT MIN(expiry_date) FROM blood_bank WHERE blood_type = OLD.blood_type)
+               WHERE blood_type = OLD.blood_type;
+               INSERT INTO inventory_summary (blood_type, total_ml, unit_count, earliest_expiry)
+               VALUES (NEW.blood_type, NEW.quantity_ml, 1, NEW.expiry_date)
+               ON CONFLICT (blood_type) DO UPDATE SET
+                   total_ml = total_ml + excluded.total_ml,
+                   unit_count = unit_count + 1,
+                   earliest_expiry = MIN(COALESCE(earliest_expiry, excluded.earliest_expiry),
+                                         excluded.earliest_expiry);
+           END""",
+        """INSERT OR REPLACE INTO inventory_summary (blood_type, total_ml, unit_count, earliest_expiry)
+           SELECT blood_type, SUM(quantity_ml), COUNT(*), MIN(expiry_date)
+           FROM blood_bank GROUP BY blood_type""",
+    ]),
+    # 3: expiry sweeping and pending-request matching
+    (3, [
+        """CREATE TABLE IF NOT EXISTS blood_bank_expired (
+               id INTEGER PRIMARY KEY,
+               blood_type TEXT NOT NULL,
+               quantity_ml INTEGER NOT NULL,
+               donor_id INTEGER,
+               collection_date TEXT NOT NULL,
+               expiry_date TEXT NOT NULL,
+               FOREIGN KEY (donor_id) REFERENCES donors (id)
+           )""",
+        # Sweep: WHERE expiry_date <= ?
+        """CREATE INDEX IF NOT EXISTS idx_blood_bank_expiry
+           ON blood_bank (expiry_date)""",
+        # Matcher: WHERE status = 'pending' ORDER BY request_date, id
+        """CREATE INDEX IF NOT EXISTS idx_blood_requests_pending
+           ON blood_requests (request_date, id) WHERE status = 'pending'""",
+    ]),
+    # 4: per-person history versions for dashboard fragment caching, bumped
+    # by triggers whenever a donor's units or a recipient's requests change
+    (4, [
+        "ALTER TABLE donors ADD COLUMN history_version INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE recipients ADD COLUMN history_version INTEGER NOT NULL DEFAULT 0",
+        """CREATE TRIGGER IF NOT EXISTS trg_blood_bank_history_insert
+           AFTER INSERT ON blood_bank WHEN NEW.donor_id IS NOT NULL
+           BEGIN
+               UPDATE donors SET history_version = history_version + 1 WHERE id = NEW.donor_id;
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_blood_bank_history_delete
+           AFTER DELETE ON blood_bank WHEN OLD.donor_id IS NOT NULL
+           BEGIN
+               UPDATE donors SET history_version = history_version + 1 WHERE id = OLD.donor_id;
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_blood_bank_history_update
+           AFTER UPDATE ON blood_bank
+           BEGIN
+               UPDATE donors SET history_version = history_version + 1 WHERE id IN (OLD.donor_id, NEW.donor_id);
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_blood_requests_history_insert
+           AFTER INSERT ON blood_requests WHEN NEW.recipient_id IS NOT NULL
+           BEGIN
+               UPDATE recipients SET history_version = history_version + 1 WHERE id = NEW.recipient_id;
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_blood_requests_history_update
+           AFTER UPDATE ON blood_requests
+           BEGIN
+               UPDATE recipients SET history_version = history_version + 1
+               WHERE id IN (OLD.recipient_id, NEW.recipient_id);
+           END""",
+    ]),
+    # 5: daily per-type stock flows for analytics.py, kept current by
+    # triggers. Allocation deletes the units it uses up, so issued_ml cannot
+    # be recomputed from history later; it is recorded as units leave.
+    (5, [
+        """CREATE TABLE IF NOT EXISTS daily_stock_flows (
+               day TEXT NOT NULL,
+               blood_type TEXT NOT NULL,
+               donated_ml INTEGER NOT NULL DEFAULT 0,
+               donated_units INTEGER NOT NULL DEFAULT 0,
+               issued_ml INTEGER NOT NULL DEFAULT 0,
+               expired_ml INTEGER NOT NULL DEFAULT 0,
+               expired_units INTEGER NOT NULL DEFAULT 0,
+               requested_ml INTEGER NOT NULL DEFAULT 0,
+               unmet_ml INTEGER NOT NULL DEFAULT 0,
+               PRIMARY KEY (day, blood_type)
+           ) WITHOUT ROWID""",
+        """CREATE TRIGGER IF NOT EXISTS trg_blood_bank_flows_insert
+           AFTER INSERT ON blood_bank
+           BEGIN
+               INSERT INTO daily_stock_flows (day, blood_type, donated_ml, donated_units)
+               VALUES (NEW.collection_date, NEW.blood_type, NEW.quantity_ml, 1)
+               ON CONFLICT (day, blood_type) DO UPDATE SET
+                   donated_ml = donated_ml + excluded.donated_ml,
+                   donated_units = donated_units + 1;
+           END""",
+        # Units past their expiry date leave through the sweep and count as
+        # waste on the day they expired; any other removal is an issue today
+        """CREATE TRIGGER IF NOT EXISTS trg_blood_bank_flows_expired
+           AFTER DELETE ON blood_bank WHEN OLD.expiry_date <= date('now', 'localtime')
+           BEGIN
+               INSERT INTO daily_stock_flows (day, blood_type, expired_ml, expired_units)
+               VALUES (OLD.expiry_date, OLD.blood_type, OLD.quantity_ml, 1)
+               ON CONFLICT (day, blood_type) DO UPDATE SET
+                   expired_ml = expired_ml + excluded.expired_ml,
+                   expired_units = expired_units + 1;
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_blood_bank_flows_issued
+           AFTER DELETE ON blood_bank WHEN OLD.expiry_date > date('now', 'localtime')
+           BEGIN
+               INSERT INTO daily_stock_flows (day, blood_type, issued_ml)
+               VALUES (date('now', 'localtime'), OLD.blood_type, OLD.quantity_ml)
+               ON CONFLICT (day, blood_type) DO UPDATE SET issued_ml = issued_ml + excluded.issued_ml;
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_blood_bank_flows_partial
+           AFTER UPDATE OF quantity_ml ON blood_bank WHEN NEW.quantity_ml < OLD.quantity_ml
+           BEGIN
+               INSERT INTO daily_stock_flows (day, blood_type, issued_ml)
+               VALUES (date('now', 'localtime'), OLD.blood_type, OLD.quantity_ml - NEW.quantity_ml)
+               ON CONFLICT (day, blood_type) DO UPDATE SET issued_ml = issued_ml + excluded.issued_ml;
+           END""",
+        """CREATE TRIGGER IF NOT EXISTS trg_blood_requests_flows_insert
+           AFTER INSERT ON blood_requests
+           BEGIN
+               INSERT INTO daily_stock_flows (day, blood_type, requested_ml, unmet_ml)
+               VALUES (NEW.request_date, NEW.blood_type, NEW.quantity_ml,
+                       CASE WHEN NEW.status = 'pending' THEN NEW.quantity_ml ELSE 0 END)
+               ON CONFLICT (day, blood_type) DO UPDATE SET
+                   requested_ml = requested_ml + excluded.requested_ml,
+                   unmet_ml = unmet_ml + excluded.unmet_ml;
+           END""",
+        # Backfill from the history that survives: live and archived units
+        # for donations and waste, and fulfilled requests (by requested
+        # type) for issues
+        """INSERT INTO daily_stock_flows (day, blood_type, donated_ml, donated_units)
+           SELECT collection_date, blood_type, SUM(quantity_ml), COUNT(*)
+           FROM (SELECT collection_date, blood_type, quantity_ml FROM blood_bank
+                 UNION ALL
+                 SELECT collection_date, blood_type, quantity_ml FROM blood_bank_expired)
+           GROUP BY collection_date, blood_type""",
+        """INSERT INTO daily_stock_flows (day, blood_type, expired_ml, expired_units)
+           SELECT expiry_date, blood_type, SUM(quantity_ml), COUNT(*)
+           FROM blood_bank_expired GROUP BY expiry_date, blood_type
+           ON CONFLICT (day, blood_type) DO UPDATE SET
+               expired_ml = excluded.expired_ml, expired_units = excluded.expired_units""",
+        """INSERT INTO daily_stock_flows (day, blood_type, issued_ml, requested_ml, unmet_ml)
+           SELECT request_date, blood_type,
+                  SUM(CASE WHEN status = 'fulfilled' THEN quantity_ml ELSE 0 END),
+                  SUM(quantity_ml),
+                  SUM(CASE WHEN status = 'pending' THEN quantity_ml ELSE 0 END)
+           FROM blood_requests GROUP BY request_date, blood_type
+           ON CONFLICT (day, blood_type) DO UPDATE SET
+               issued_ml = excluded.issued_ml, requested_ml = excluded.requested_ml,
+               unmet_ml = excluded.unmet_ml""",
+    ]),
+    # 6: donor history includes archived units (DonorRepo.donations)
+    (6, [
+        """CREATE INDEX IF NOT EXISTS idx_blood_bank_expired_donor
+           ON blood_bank_expired (donor_id, collection_date)""",
+    ]),
+    # 7: allocation orders by expiry, so nothing reads the collection-order index
+    (7, [
+        "DROP INDEX IF EXISTS idx_blood_bank_type_collection",
+    ]),
+    # 8: allocation reads ORDER BY expiry_date, id off the type/expiry index,
+    # so id has to follow expiry_date in it
+    (8, [
+        "DROP INDEX IF EXISTS idx_blood_bank_type_expiry",
+        """CREATE INDEX idx_blood_bank_type_expiry
+           ON blood_bank (blood_type, expiry_date, id, quantity_ml)""",
+    ]),
+]
+
+
+def migrate(connection):
+    """Apply pending MIGRATIONS, each in its own transaction
+
+    Returns the schema version the database ends up at.
+    """
+    version = connection.execute("PRAGMA user_version").fetchone()[0]
+    for target, statements in MIGRATIONS:
+        if target <= version:
+            continue
+        connection.execute("BEGIN IMMEDIATE")
+        # Another process may have applied it while this one waited for the lock
+        version = connection.execute("PRAGMA user_version").fetchone()[0]
+        if target <= version:
+            connection.rollback()
+            continue
+        try:
+            for statement in statements:
+                connection.execute(statement)
+            connection.execute(f"PRAGMA user_version = {int(target)}")
+        except Exception:
+            connection.rollback()
+            raise
+        connection.commit()
+        version = target
+    return version
+
+
+DEFAULT_SHARD = 'default'
+_SHARD_NAME = re.compile(r'[A-Za-z0-9_-]+')
+
+
+class SQLiteBackend:
+    """Storage in a single SQLite database file
+
+    A storage backend names the shards data lives in, opens connections to
+    them and creates the schema; Database keeps one connection pool per
+    shard. This backend has a single shard, DEFAULT_SHARD.
+    """
+    def __init__(self, database='blood_bank.db', busy_timeout=5000):
+        self.database = database
+        self.busy_timeout = busy_timeout
+
+    def shards(self):
+        """{shard name: connection target}, default shard first"""
+        return {DEFAULT_SHARD: self.database}
+
+    def connect(self, target):
+        """Open a new connection configured for concurrent use"""
+        # Connections move between threads across checkouts, but a single
+        # connection is only ever used by one thread at a time.
+        connection = sqlite3.connect(target, timeout=self.busy_timeout / 1000.0,
+                                     check_same_thread=False)
+        connection.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout)}")
+        return connection
+
+    def create_schema(self, connection):
+        """Create missing tables and apply pending migrations"""
+        # WAL lets readers proceed while a writer holds the lock; the
+        # setting is persistent, so existing database files switch over too
+        connection.execute("PRAGMA journal_mode = WAL")
+
+        with connection:
             cursor = connection.cursor()
-            
+
             # Create donors table
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS donors (
@@ -26,7 +551,7 @@ class Database:
                     last_donation_date TEXT
                 )
             ''')
-            
+
             # Create recipients table
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS recipients (
@@ -41,7 +566,7 @@ class Database:
                     last_request_date TEXT
                 )
             ''')
-            
+
             # Create blood_bank table
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS blood_bank (
@@ -54,7 +579,7 @@ class Database:
                     FOREIGN KEY (donor_id) REFERENCES donors (id)
                 )
             ''')
-            
+
             # Create blood_requests table
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS blood_requests (
@@ -68,30 +593,177 @@ class Database:
                 )
             ''')
 
+        # Bring existing database files up to the current schema version
+        migrate(connection)
+
+
+class ShardedSQLiteBackend(SQLiteBackend):
+    """One SQLite file per region, e.g. shards/north.db and shards/south.db
+
+    Every shard is a complete blood bank with its own donors, recipients,
+    stock and requests, so allocation never crosses shards and each shard
+    has its own write lock: writes in different regions never wait on each
+    other. Code picks its shard with Database.use_shard; the first name is
+    the default.
+    """
+    def __init__(self, directory, names, busy_timeout=5000):
+        super().__init__(None, busy_timeout)
+        names = list(names)
+        if not names:
+            raise ValueError("A sharded layout needs at least one shard")
+        for name in names:
+            if not _SHARD_NAME.fullmatch(name):
+                raise ValueError(f"Invalid shard name {name!r}")
+        self.directory = directory
+        self.names = names
+        os.makedirs(directory, exist_ok=True)
+
+    def shards(self):
+        return {name: os.path.join(self.directory, f'{name}.db') for name in self.names}
+
+
+def backend_from_environment(database='blood_bank.db'):
+    """Storage backend chosen by the environment
+
+    BLOOD_BANK_SHARDS, a comma-separated list of region names, selects the
+    sharded layout with one file per region in BLOOD_BANK_SHARD_DIR
+    (default 'shards'); otherwise everything is stored in database.
+    BLOOD_BANK_BUSY_TIMEOUT_MS sets how long a connection waits for another
+    writer's lock (default 5000).
+    """
+    busy_timeout = int(os.environ.get('BLOOD_BANK_BUSY_TIMEOUT_MS', 5000))
+    names = [name.strip() for name in os.environ.get('BLOOD_BANK_SHARDS', '').split(',') if name.strip()]
+    if names:
+        return ShardedSQLiteBackend(os.environ.get('BLOOD_BANK_SHARD_DIR', 'shards'), names, busy_timeout)
+    return SQLiteBackend(database, busy_timeout)
+
+
+class Database:
+    """Database connection manager class"""
+    __pools = {}
+    __default_shard = None
+    _local = threading.local()
+
     @classmethod
-    def get_connection(cls):
-        """Get a connection from the pool"""
-        if cls.__connection_pool is None:
+    def initialize(cls, database='blood_bank.db', pool_size=8, pool_timeout=30.0, busy_timeout=5000, backend=None):
+        """Initialize a connection pool per shard of backend (default: SQLiteBackend(database))
+
+        busy_timeout only applies to the default backend; a backend passed
+        in brings its own.
+        """
+        backend = backend or SQLiteBackend(database, busy_timeout)
+        pools = {
+            name: ConnectionPool(partial(backend.connect, target), max_size=pool_size, timeout=pool_timeout)
+            for name, target in backend.shards().items()
+        }
+        previous_pools = cls.__pools
+        cls.__pools = pools
+        cls.__default_shard = next(iter(pools))
+        for pool in previous_pools.values():
+            pool.close()
+
+        for pool in pools.values():
+            connection = pool.checkout()
+            try:
+                backend.create_schema(connection)
+            finally:
+                pool.checkin(connection)
+
+    @classmethod
+    def shards(cls):
+        """Names of the configured shards, default first"""
+        return list(cls.__pools)
+
+    @classmethod
+    def current_shard(cls):
+        """Shard the current thread works on"""
+        return getattr(cls._local, 'shard', None) or cls.__default_shard
+
+    @classmethod
+    @contextmanager
+    def use_shard(cls, name):
+        """Direct this thread's CursorFromConnectionPool blocks to shard name"""
+        if name not in cls.__pools:
+            raise KeyError(f"Unknown shard {name!r}")
+        previous = getattr(cls._local, 'shard', None)
+        cls._local.shard = name
+        try:
+            yield name
+        finally:
+            cls._local.shard = previous
+
+    @classmethod
+    def pool(cls, shard=None):
+        """ConnectionPool of shard (default: current)"""
+        if not cls.__pools:
             cls.initialize()
-        return cls.__connection_pool
+        return cls.__pools[shard or cls.current_shard()]
+
+    @classmethod
+    def get_connection(cls):
+        """Get a connection from the current shard's pool"""
+        return cls.pool().checkout()
+
+    @classmethod
+    def release_connection(cls, connection, shard=None):
+        """Return a connection obtained from get_connection to the pool"""
+        cls.__pools[shard or cls.current_shard()].checkin(connection)
+
+    @classmethod
+    def pool_stats(cls, shard=None):
+        """Pool size and wait metrics for shard (default: current), or None before initialize"""
+        pool = cls.__pools.get(shard or cls.current_shard())
+        if pool is None:
+            return None
+        return pool.stats()
+
 
 class CursorFromConnectionPool:
-    """Context manager for database cursors"""
+    """Context manager for database cursors
+
+    Nested blocks on the same thread share the outer block's connection and
+    transaction; only the outermost block commits or rolls back. The
+    connection goes back to the pool it came from, even if Database was
+    initialized again in the meantime.
+    """
+    _local = threading.local()
+
     def __init__(self):
         self.connection = None
         self.cursor = None
+        self.owns_connection = False
 
     def __enter__(self):
-        self.connection = Database.get_connection()
-        self.cursor = self.connection.cursor()
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            pool = Database.pool()
+            connection = pool.checkout()
+            self.owns_connection = True
+            self._local.connection = connection
+            self._local.shard = Database.current_shard()
+            self._local.pool = pool
+        elif self._local.shard != Database.current_shard():
+            raise sqlite3.ProgrammingError("A transaction cannot span shards")
+        self.connection = connection
+        self.cursor = self.connection.cursor(InstrumentedCursor if query_stats.enabled else CountingCursor)
         return self.cursor
 
     def __exit__(self, exception_type, exception_value, exception_traceback):
-        if exception_value:  # If there was an exception
-            self.connection.rollback()
-        else:
-            self.connection.commit()
-        
-        # Don't close the connection, as we're reusing it in a pool
         if self.cursor:
-            self.cursor.close()
\ No newline at end of file
+            self.cursor.close()
+
+        if not self.owns_connection:
+            return
+
+        try:
+            started = time.perf_counter() if query_stats.enabled else None
+            if exception_value:  # If there was an exception
+                self.connection.rollback()
+            else:
+                self.connection.commit()
+            if started is not None:
+                query_stats.record_transaction('rollback' if exception_value else 'commit',
+                                               time.perf_counter() - started)
+        finally:
+            self._local.connection = None
+            self._local.pool.checkin(self.connection)
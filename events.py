@@ -0,0 +1,135 @@
+"""Server-sent inventory change events
+
+One InventoryBroker per process turns stock invalidations into a short
+feed of per-blood-type events. Subscribers share a single ring buffer and
+condition variable, so an idle subscriber costs a few bytes of state rather
+than a queue or a thread of its own. Stock is only re-read when at least
+one client of that shard is listening.
+
+Invalidations only fire for writes made by this process. Streams call
+refresh() whenever they sit idle, which re-reads the stock at most once
+per interval per shard, so changes made by other worker processes reach
+every client within that interval.
+
+Each event carries the type's inventory_levels() entry plus delta_ml, the
+change in its own available_ml, and compatible_delta_ml, the change in
+compatible_available_ml (what a recipient of that type can draw on).
+"""
+from collections import deque
+from database import Database
+from inventory import add_stock_listener, inventory_levels
+import json
+import threading
+import time
+
+BUFFER_SIZE = 256
+
+
+class InventoryBroker:
+    """Publishes inventory changes as (seq, shard, blood_type, data) events"""
+
+    def __init__(self, buffer_size=BUFFER_SIZE):
+        self._events = deque(maxlen=buffer_size)
+        self._condition = threading.Condition()
+        # Serialises re-reads so an older read never replaces a newer baseline
+        self._publish_lock = threading.Lock()
+        self._seq = 0
+        # Per shard: listening clients, the stock levels last published and
+        # when they were read
+        self._subscribers = {}
+        self._levels = {}
+        self._read_at = {}
+        self.published = 0
+
+    def subscribe(self, shard):
+        """Start listening to shard; returns the sequence number to read from"""
+        with self._condition:
+            self._subscribers[shard] = self._subscribers.get(shard, 0) + 1
+            return self._seq
+
+    def unsubscribe(self, shard):
+        with self._condition:
+            self._subscribers[shard] -= 1
+            if not self._subscribers[shard]:
+                del self._subscribers[shard]
+                self._levels.pop(shard, None)
+                self._read_at.pop(shard, None)
+
+    @property
+    def subscribers(self):
+        return sum(self._subscribers.values())
+
+    @property
+    def latest(self):
+        """Sequence number of the newest event"""
+        return self._seq
+
+    def publish(self, blood_types=()):
+        """Re-read the current shard's stock and queue an event for every type whose level moved"""
+        shard = Database.current_shard()
+        with self._condition:
+            if shard not in self._subscribers:
+                return
+        with self._publish_lock:
+            levels = inventory_levels()
+            with self._condition:
+                previous = self._levels.get(shard)
+                self._levels[shard] = levels
+                self._read_at[shard] = time.monotonic()
+                if previous is None:
+                    return
+                for blood_type, entry in levels.items():
+                    before = previous[blood_type]
+                    if entry == before:
+                        continue
+                    self._seq += 1
+                    data = json.dumps(dict(
+                        entry,
+                        delta_ml=entry['available_ml'] - before['available_ml'],
+                        compatible_delta_ml=entry['compatible_available_ml'] - before['compatible_available_ml'],
+                    ))
+                    self._events.append((self._seq, shard, blood_type, data))
+                    self.published += 1
+                self._condition.notify_all()
+
+    def refresh(self, shard, max_age):
+        """Publish shard's changes from other processes, unless its stock was read within max_age seconds"""
+        with self._condition:
+            if time.monotonic() - self._read_at.get(shard, float('-inf')) < max_age:
+                return
+            # Claimed before reading so idle streams don't all re-read at once
+            self._read_at[shard] = time.monotonic()
+        with Database.use_shard(shard):
+            self.publish()
+
+    def prime(self, shard):
+        """Record shard's current stock as the baseline later changes are diffed against"""
+        with self._condition:
+            if shard in self._levels:
+                return
+        levels = inventory_levels()
+        with self._condition:
+            self._levels.setdefault(shard, levels)
+            self._read_at.setdefault(shard, time.monotonic())
+
+    def wait(self, after_seq, timeout):
+        """Events newer than after_seq, waiting up to timeout seconds for one
+
+        Returns an empty list on timeout, or None if events after after_seq
+        have already been dropped from the buffer and the caller must
+        resynchronise from a full snapshot.
+        """
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while self._seq <= after_seq:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return []
+                self._condition.wait(remaining)
+            if self._events[0][0] > after_seq + 1:
+                return None
+            return [event for event in self._events if event[0] > after_seq]
+
+
+broker = InventoryBroker()
+add_stock_listener(broker.publish)
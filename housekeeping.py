@@ -0,0 +1,140 @@
+from database import CursorFromConnectionPool, Database
+from inventory import allocate_units, donor_types_for, invalidate_availability
+import datetime
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def sweep_expired_units(batch_size=500, archive=True, today=None):
+    """Move expired units out of blood_bank in batches
+
+    Units whose expiry_date has passed are copied to blood_bank_expired
+    (or simply deleted when archive is False). Each batch is its own short
+    transaction so request handlers never queue behind a long sweep.
+    Returns the number of units removed.
+    """
+    today = today or datetime.date.today()
+    removed = 0
+
+    while True:
+        with CursorFromConnectionPool() as cursor:
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute("SELECT id FROM blood_bank WHERE expiry_date <= ? ORDER BY expiry_date LIMIT ?",
+                           (today, batch_size))
+            unit_ids = [row[0] for row in cursor.fetchall()]
+            if not unit_ids:
+                break
+
+            placeholders = ','.join('?' * len(unit_ids))
+            if archive:
+                cursor.execute(f"""
+                    INSERT OR REPLACE INTO blood_bank_expired (id, blood_type, quantity_ml, donor_id, collection_date, expiry_date)
+                    SELECT id, blood_type, quantity_ml, donor_id, collection_date, expiry_date
+                    FROM blood_bank WHERE id IN ({placeholders})
+                """, unit_ids)
+            cursor.execute(f"DELETE FROM blood_bank WHERE id IN ({placeholders})", unit_ids)
+
+        removed += len(unit_ids)
+        if len(unit_ids) < batch_size:
+            break
+
+    return removed
+
+
+def match_pending_requests(batch_size=100, today=None):
+    """Fulfil pending blood_requests from current stock, oldest first
+
+    Requests are visited in (request_date, id) order; one that cannot be
+    covered yet is left pending without blocking smaller requests behind
+    it. Returns the ids of the requests that were fulfilled.
+    """
+    today = today or datetime.date.today()
+    fulfilled = []
+    touched_types = set()
+    last_key = ('', 0)
+
+    while True:
+        with CursorFromConnectionPool() as cursor:
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute("""
+                SELECT id, blood_type, quantity_ml, request_date
+                FROM blood_requests
+                WHERE status = 'pending' AND (request_date, id) > (?, ?)
+                ORDER BY request_date, id
+                LIMIT ?
+            """, (last_key[0], last_key[1], batch_size))
+            pending = cursor.fetchall()
+
+            for request_id, blood_type, quantity_ml, request_date in pending:
+                if allocate_units(cursor, blood_type, quantity_ml, today) is not None:
+                    cursor.execute("UPDATE blood_requests SET status = 'fulfilled' WHERE id = ?", (request_id,))
+                    fulfilled.append(request_id)
+                    touched_types.update(donor_types_for(blood_type))
+
+        if touched_types:
+            invalidate_availability(*touched_types)
+            touched_types.clear()
+
+        if len(pending) < batch_size:
+            break
+        last_key = (pending[-1][3], pending[-1][0])
+
+    return fulfilled
+
+
+class Housekeeper(threading.Thread):
+    """Background thread that sweeps expired units and matches pending requests
+
+    Runs both jobs every interval seconds; notify_stock() wakes it early to
+    match pending requests as soon as new units land, so the donation route
+    itself never waits on matching. Sweeps are timed from the last sweep,
+    not the last wake-up, so a steady stream of donations cannot hold them off.
+    """
+    def __init__(self, interval=300.0, batch_size=500):
+        super().__init__(name='housekeeper', daemon=True)
+        self.interval = interval
+        self.batch_size = batch_size
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._last_sweep = time.monotonic()
+
+    def notify_stock(self):
+        """Ask the thread to match pending requests against new stock"""
+        self._wake.set()
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+
+    def run(self):
+        self._last_sweep = time.monotonic()
+        while not self._stopped.is_set():
+            self._wake.wait(max(0.0, self._last_sweep + self.interval - time.monotonic()))
+            self._wake.clear()
+            if self._stopped.is_set():
+                break
+            self.run_jobs()
+
+    def run_jobs(self, now=None):
+        """Match pending requests on every shard, sweeping first if a sweep is due"""
+        now = time.monotonic() if now is None else now
+        sweep_due = now - self._last_sweep >= self.interval
+        if sweep_due:
+            self._last_sweep = now
+
+        for shard in Database.shards():
+            try:
+                with Database.use_shard(shard):
+                    if sweep_due:
+                        swept = sweep_expired_units(self.batch_size)
+                        if swept:
+                            logger.info("Swept %d expired blood units in %s", swept, shard)
+                    matched = match_pending_requests()
+                    if matched:
+                        logger.info("Fulfilled %d pending blood requests in %s", len(matched), shard)
+            except Exception:
+                # Keep the thread alive; the next run will retry
+                logger.exception("Housekeeping run failed for %s", shard)
@@ -0,0 +1,380 @@
+from collections import namedtuple
+from cache import TTLCache
+from compatibility import BLOOD_TYPES, compatible_donors, compatible_recipients, preference_order
+from database import CursorFromConnectionPool, Database
+from repositories import RecipientRepo, next_request_date
+import datetime
+import hashlib
+import json
+import os
+import threading
+import time
+
+# Result of a fulfilment attempt: the blood_requests row that was written,
+# its status, the blood_bank unit ids that were drawn from (in draw order)
+# and the recipient's blood type
+Allocation = namedtuple('Allocation', ['request_id', 'status', 'unit_ids', 'blood_type'])
+
+# How allocate_units chooses among compatible donor types:
+#   exact_first      the recipient's own type, then the other compatible types
+#                    from most to least plentiful, so scarce stock goes last
+#   earliest_expiry  all compatible types together, soonest expiry first
+#   exact_only       the recipient's own type only
+ALLOCATION_POLICIES = ('exact_first', 'earliest_expiry', 'exact_only')
+allocation_policy = os.environ.get('BLOOD_BANK_ALLOCATION_POLICY', 'exact_first')
+if allocation_policy not in ALLOCATION_POLICIES:
+    raise ValueError(f"Unknown BLOOD_BANK_ALLOCATION_POLICY {allocation_policy!r}, "
+                     f"expected one of {', '.join(ALLOCATION_POLICIES)}")
+
+# Compatible availability per recipient type and shard, as shown on dashboards.
+# Writers to blood_bank call invalidate_availability once their transaction
+# has committed; set BLOOD_BANK_INVENTORY_CACHE=off (or
+# availability_cache.enabled = False) to always read through to the database.
+availability_cache = TTLCache(
+    ttl=30.0,
+    max_entries=64,
+    enabled=os.environ.get('BLOOD_BANK_INVENTORY_CACHE', 'on').lower() not in ('0', 'off', 'false'),
+)
+
+# Serialized inventory for the JSON API, rebuilt after every stock change in
+# this process (or when the TTL picks up writes made by another process).
+# ETags hash the content, so every worker process agrees on them.
+snapshot_cache = TTLCache(ttl=30.0, max_entries=16, enabled=availability_cache.enabled)
+
+# Per shard: (ETag, Last-Modified) of the latest snapshot
+_validators_lock = threading.Lock()
+_snapshot_validators = {}
+
+# Called with the changed blood types after every committed stock change,
+# on the thread (and so in the shard) that made it
+_stock_listeners = []
+
+# One serialized document plus its validators
+InventoryDocument = namedtuple('InventoryDocument', ['body', 'etag', 'last_modified'])
+
+
+def stock_by_type(cursor, blood_types, today=None):
+    """Unexpired millilitres in stock for each of blood_types
+
+    Answered from inventory_summary in one indexed lookup. Only types that
+    still hold units past their expiry date (not yet swept) fall back to
+    totalling their live units over the expiry index.
+    """
+    today = today or datetime.date.today()
+    blood_types = list(blood_types)
+    placeholders = ','.join('?' * len(blood_types))
+    cursor.execute(f"SELECT blood_type, total_ml, earliest_expiry FROM inventory_summary WHERE blood_type IN ({placeholders})",
+                   blood_types)
+
+    stock = {}
+    stale = []
+    for blood_type, total_ml, earliest_expiry in cursor.fetchall():
+        if not total_ml:
+            continue
+        if earliest_expiry > today.isoformat():
+            stock[blood_type] = total_ml
+        else:
+            stale.append(blood_type)
+
+    if stale:
+        placeholders = ','.join('?' * len(stale))
+        cursor.execute(f"""
+            SELECT blood_type, SUM(quantity_ml) FROM blood_bank
+            WHERE blood_type IN ({placeholders}) AND expiry_date > ?
+            GROUP BY blood_type
+        """, stale + [today])
+        stock.update(cursor.fetchall())
+
+    return stock
+
+
+def donor_types_for(blood_type, policy=None):
+    """Blood types a recipient of blood_type may be allocated under policy"""
+    if (policy or allocation_policy) == 'exact_only':
+        return (blood_type,)
+    return compatible_donors(blood_type)
+
+
+def available_ml(cursor, blood_type, today=None, policy=None):
+    """Unexpired millilitres a recipient of blood_type could be allocated"""
+    return sum(stock_by_type(cursor, donor_types_for(blood_type, policy), today).values())
+
+
+def cached_available_ml(cursor, blood_type):
+    """available_ml through availability_cache, for read-only pages"""
+    today = datetime.date.today()
+    return availability_cache.get_or_load(
+        (blood_type, today, Database.current_shard()),
+        lambda: available_ml(cursor, blood_type, today)
+    )
+
+
+def invalidate_availability(*blood_types):
+    """Forget cached availability affected by stock changes of blood_types
+
+    Cache entries are keyed by recipient type, so every recipient type that
+    can receive one of blood_types is dropped. With no arguments the whole
+    cache is cleared. Only entries for the current shard are affected.
+    """
+    shard = Database.current_shard()
+    snapshot_cache.invalidate(lambda key: key[0] == shard)
+    for listener in _stock_listeners:
+        listener(blood_types)
+
+    if not blood_types:
+        availability_cache.invalidate(lambda key: key[2] == shard)
+        return
+
+    affected = set()
+    for blood_type in blood_types:
+        affected.update(compatible_recipients(blood_type))
+    availability_cache.invalidate(lambda key: key[0] in affected and key[2] == shard)
+
+
+def add_stock_listener(listener):
+    """Register listener(blood_types) to run after each stock change (empty = any type)"""
+    _stock_listeners.append(listener)
+
+
+def _document(payload, last_modified):
+    body = json.dumps(payload, sort_keys=True, separators=(',', ':')).encode()
+    return InventoryDocument(body, hashlib.sha1(body).hexdigest()[:20], last_modified)
+
+
+def inventory_levels(today=None):
+    """Stock of every blood type as {blood_type: {available_ml, unit_count, earliest_expiry, compatible_available_ml}}"""
+    today = today or datetime.date.today()
+    with CursorFromConnectionPool() as cursor:
+        cursor.execute("SELECT blood_type, total_ml, unit_count, earliest_expiry FROM inventory_summary")
+        rows = {row[0]: row[1:] for row in cursor.fetchall()}
+
+        # Types holding unswept expired units are totalled from their live units
+        stale = [t for t, (total_ml, _, earliest) in rows.items() if total_ml and earliest <= today.isoformat()]
+        if stale:
+            placeholders = ','.join('?' * len(stale))
+            cursor.execute(f"""
+                SELECT blood_type, SUM(quantity_ml), COUNT(*), MIN(expiry_date) FROM blood_bank
+                WHERE blood_type IN ({placeholders}) AND expiry_date > ?
+                GROUP BY blood_type
+            """, stale + [today])
+            for blood_type in stale:
+                rows[blood_type] = (0, 0, None)
+            rows.update({row[0]: row[1:] for row in cursor.fetchall()})
+
+    stock = {t: rows.get(t, (0, 0, None)) for t in BLOOD_TYPES}
+    levels = {}
+    for blood_type in BLOOD_TYPES:
+        total_ml, unit_count, earliest_expiry = stock[blood_type]
+        levels[blood_type] = {
+            'blood_type': blood_type,
+            'available_ml': total_ml or 0,
+            'unit_count': unit_count or 0,
+            'earliest_expiry': earliest_expiry if total_ml else None,
+            'compatible_available_ml': sum(stock[d][0] or 0 for d in compatible_donors(blood_type)),
+        }
+    return levels
+
+
+def _load_inventory_documents(shard, today):
+    """Serialize stock for every blood type: {None: all types, type: one type}"""
+    types = inventory_levels(today)
+
+    all_types = _document({'as_of': today.isoformat(), 'blood_types': types}, None)
+    with _validators_lock:
+        etag, last_modified = _snapshot_validators.get(shard, (None, None))
+        if all_types.etag != etag:
+            last_modified = time.time()
+            _snapshot_validators[shard] = (all_types.etag, last_modified)
+
+    documents = {None: all_types._replace(last_modified=last_modified)}
+    for blood_type, entry in types.items():
+        documents[blood_type] = _document(dict(entry, as_of=today.isoformat()), last_modified)
+    return documents
+
+
+def inventory_document(blood_type=None):
+    """Serialized stock for one blood type, or all of them, with ETag and Last-Modified
+
+    Served from snapshot_cache, so repeated polls between stock changes do
+    not touch the database. Returns None for an unknown blood type.
+    """
+    if blood_type is not None and blood_type not in BLOOD_TYPES:
+        return None
+    today = datetime.date.today()
+    shard = Database.current_shard()
+    documents = snapshot_cache.get_or_load((shard, today), lambda: _load_inventory_documents(shard, today))
+    return documents[blood_type]
+
+
+def rebuild_inventory_summary():
+    """Rebuild inventory_summary from blood_bank and report drift
+
+    Returns a list of (blood_type, summary_row, recomputed_row) tuples for
+    every blood type whose stored summary did not match blood_bank, where
+    each row is (total_ml, unit_count, earliest_expiry) or None.
+    """
+    with CursorFromConnectionPool() as cursor:
+        cursor.execute("BEGIN IMMEDIATE")
+
+        cursor.execute("SELECT blood_type, total_ml, unit_count, earliest_expiry FROM inventory_summary")
+        stored = {row[0]: tuple(row[1:]) for row in cursor.fetchall()}
+
+        cursor.execute("""
+            SELECT blood_type, SUM(quantity_ml), COUNT(*), MIN(expiry_date)
+            FROM blood_bank GROUP BY blood_type
+        """)
+        expected = {row[0]: tuple(row[1:]) for row in cursor.fetchall()}
+
+        drift = []
+        for blood_type in sorted(set(stored) | set(expected)):
+            # A summary row left at zero after its last unit went is not drift
+            stored_row = stored.get(blood_type)
+            if stored_row is not None and stored_row[1] == 0 and blood_type not in expected:
+                continue
+            if stored_row != expected.get(blood_type):
+                drift.append((blood_type, stored_row, expected.get(blood_type)))
+
+        cursor.execute("DELETE FROM inventory_summary")
+        cursor.executemany(
+            "INSERT INTO inventory_summary (blood_type, total_ml, unit_count, earliest_expiry) VALUES (?, ?, ?, ?)",
+            [(blood_type,) + row for blood_type, row in expected.items()]
+        )
+
+    if drift:
+        invalidate_availability()
+
+    return drift
+
+
+def allocate_units(cursor, blood_type, quantity_ml, today, policy=None):
+    """Debit quantity_ml for a recipient of blood_type from compatible stock
+
+    Must run inside a write transaction. Which compatible types are drawn
+    from depends on policy (see ALLOCATION_POLICIES); within that order,
+    units that expire soonest are used first. Returns the ids of the units
+    drawn from, or None (and changes nothing) if there is not enough stock.
+    """
+    policy = policy or allocation_policy
+    stock = stock_by_type(cursor, donor_types_for(blood_type, policy), today)
+    if sum(stock.values()) < quantity_ml:
+        return None
+
+    drained = []
+    if policy == 'earliest_expiry':
+        chosen = [t for t in BLOOD_TYPES if stock.get(t)]
+    else:
+        # Take whole types in preference order until the request is covered
+        chosen = []
+        covered = 0
+        for donor_type in preference_order(blood_type, stock):
+            if covered >= quantity_ml:
+                break
+            if stock.get(donor_type):
+                chosen.append(donor_type)
+                covered += stock[donor_type]
+        # Every chosen type but the last is used up completely, so only the
+        # last one is read unit by unit
+        drained, chosen = chosen[:-1], chosen[-1:]
+
+    placeholders = ','.join('?' * len(chosen))
+    # Across several types, walking the expiry index and skipping other types
+    # stops after a few units; seeking per type would sort every unit instead
+    index = "INDEXED BY idx_blood_bank_expiry" if len(chosen) > 1 else ""
+    cursor.execute(f"""
+        SELECT id, quantity_ml FROM blood_bank {index}
+        WHERE blood_type IN ({placeholders}) AND expiry_date > ?
+        ORDER BY expiry_date, id
+    """, list(chosen) + [today])
+
+    # Rows stream off an expiry-ordered index and reading stops as soon as
+    # the request is covered
+    unit_ids = []
+    remaining = quantity_ml - sum(stock[t] for t in drained)
+    for unit_id, unit_ml in cursor:
+        unit_ids.append(unit_id)
+        remaining -= unit_ml
+        if remaining <= 0:
+            break
+
+    if remaining > 0:
+        return None
+
+    if drained:
+        placeholders = ','.join('?' * len(drained))
+        params = list(drained) + [today]
+        cursor.execute(f"SELECT id FROM blood_bank WHERE blood_type IN ({placeholders}) AND expiry_date > ?", params)
+        drained_ids = [row[0] for row in cursor.fetchall()]
+        cursor.execute(f"DELETE FROM blood_bank WHERE blood_type IN ({placeholders}) AND expiry_date > ?", params)
+    else:
+        drained_ids = []
+
+    leftover = -remaining
+    consumed = unit_ids if leftover == 0 else unit_ids[:-1]
+    if consumed:
+        placeholders = ','.join('?' * len(consumed))
+        cursor.execute(f"DELETE FROM blood_bank WHERE id IN ({placeholders})", consumed)
+    if leftover:
+        cursor.execute("UPDATE blood_bank SET quantity_ml = ? WHERE id = ?", (leftover, unit_ids[-1]))
+
+    return drained_ids + unit_ids
+
+
+def fulfill_blood_request(recipient_id, quantity_ml):
+    """Record a blood request and allocate stock for it atomically
+
+    The eligibility check, the availability check, the unit debit, the
+    blood_requests row and the recipient's last_request_date are written in
+    one BEGIN IMMEDIATE transaction, so concurrent requests can neither
+    claim the same units nor both pass the 40-day rule. Returns the
+    Allocation, or None if the recipient may not request yet. Must not be
+    called inside another CursorFromConnectionPool block.
+    """
+    with CursorFromConnectionPool() as cursor:
+        # Take the write lock before reading stock so the check and the
+        # debit see the same inventory
+        cursor.execute("BEGIN IMMEDIATE")
+        allocation = record_blood_request(cursor, recipient_id, quantity_ml)
+
+    if allocation is not None:
+        request_committed(allocation)
+    return allocation
+
+
+def record_blood_request(cursor, recipient_id, quantity_ml, today=None):
+    """The body of fulfill_blood_request, inside the caller's transaction
+
+    The caller must already hold the write lock, and must call
+    request_committed() once the transaction has committed.
+    """
+    quantity_ml = int(quantity_ml)
+    if quantity_ml <= 0:
+        raise ValueError(f"quantity_ml must be positive, got {quantity_ml}")
+    today = today or datetime.date.today()
+
+    # Read under the write lock, so a second request racing this one sees
+    # the last_request_date written below
+    blood_type, last_request_date = RecipientRepo.request_profile(cursor, recipient_id)
+    if next_request_date(last_request_date) is not None:
+        return None
+
+    unit_ids = allocate_units(cursor, blood_type, quantity_ml, today)
+    status = 'pending' if unit_ids is None else 'fulfilled'
+
+    cursor.execute(
+        "INSERT INTO blood_requests (blood_type, quantity_ml, recipient_id, request_date, status) VALUES (?, ?, ?, ?, ?)",
+        (blood_type, quantity_ml, recipient_id, today, status)
+    )
+    request_id = cursor.lastrowid
+
+    # Update the last request date for the recipient
+    cursor.execute("UPDATE recipients SET last_request_date = ? WHERE id = ?",
+                   (today, recipient_id))
+
+    return Allocation(request_id, status, unit_ids or [], blood_type)
+
+
+def request_committed(allocation):
+    """Invalidate cached availability after a recorded request commits"""
+    if allocation.unit_ids:
+        # Units may have come from any compatible type
+        invalidate_availability(*donor_types_for(allocation.blood_type))
@@ -0,0 +1,195 @@
+"""Maintenance commands for the blood bank database
+
+Usage:
+    python manage.py [--database PATH] [--shard NAME] rebuild-summary
+    python manage.py [--database PATH] [--shard NAME] sweep-expired [--purge] [--batch-size N]
+    python manage.py [--database PATH] [--shard NAME] match-pending
+    python manage.py [--database PATH] [--shard NAME] import-donations FILE [--format csv|jsonl] [--batch-size N]
+    python manage.py [--database PATH] [--shard NAME] export TABLE [--output FILE] [--format csv|jsonl]
+    python manage.py [--database PATH] [--shard NAME] forecast [--window DAYS]
+    python manage.py check-storage [--shards NAME,NAME...]
+
+FILE and --output may be '-' for stdin/stdout. With a sharded layout
+(BLOOD_BANK_SHARDS) maintenance commands run on every shard unless --shard
+picks one; import-donations and export need --shard.
+"""
+import argparse
+import sys
+import tempfile
+import time
+
+from bulk import EXPORT_TABLES, export_rows, guess_format, import_donations, read_records, write_records
+from conformance import run_conformance
+from database import Database, ShardedSQLiteBackend, SQLiteBackend, backend_from_environment
+from housekeeping import match_pending_requests, sweep_expired_units
+from inventory import rebuild_inventory_summary
+
+
+def rebuild_summary(args):
+    """Rebuild inventory_summary from blood_bank and print any drift"""
+    drift = rebuild_inventory_summary()
+    if not drift:
+        print("inventory_summary is consistent with blood_bank")
+        return 0
+
+    print(f"inventory_summary had drifted for {len(drift)} blood type(s), now rebuilt:")
+    for blood_type, stored, expected in drift:
+        print(f"  {blood_type}: stored (total_ml, unit_count, earliest_expiry)={stored} actual={expected}")
+    return 1
+
+
+def sweep_expired(args):
+    """Archive (or purge) expired units from blood_bank"""
+    removed = sweep_expired_units(args.batch_size, archive=not args.purge)
+    print(f"{'Purged' if args.purge else 'Archived'} {removed} expired unit(s)")
+    return 0
+
+
+def match_pending(args):
+    """Fulfil pending requests from current stock, oldest first"""
+    fulfilled = match_pending_requests()
+    print(f"Fulfilled {len(fulfilled)} pending request(s)")
+    return 0
+
+
+def _open(path, mode):
+    if path == '-':
+        return sys.stdin if 'r' in mode else sys.stdout
+    return open(path, mode, newline='', encoding='utf-8')
+
+
+def import_donations_command(args):
+    """Record donations from a CSV/JSONL file of donor_id, quantity_ml[, collection_date]"""
+    def report_reject(line_number, record, reason):
+        print(f"record {line_number} rejected: {reason}", file=sys.stderr)
+
+    fmt = args.format or guess_format(args.file)
+    started = time.perf_counter()
+    stream = _open(args.file, 'r')
+    try:
+        imported, rejected = import_donations(read_records(stream, fmt), args.batch_size, report_reject)
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+    elapsed = time.perf_counter() - started
+
+    print(f"Imported {imported} donation(s), rejected {rejected} in {elapsed:.2f}s "
+          f"({(imported + rejected) / elapsed if elapsed else 0:.0f} rows/sec)", file=sys.stderr)
+    return 1 if rejected else 0
+
+
+def export_command(args):
+    """Stream a table out as CSV/JSONL"""
+    fmt = args.format or guess_format(args.output)
+    count = 0
+
+    def counted(rows):
+        nonlocal count
+        for row in rows:
+            count += 1
+            yield row
+
+    started = time.perf_counter()
+    stream = _open(args.output, 'w')
+    try:
+        write_records(stream, fmt, EXPORT_TABLES[args.table], counted(export_rows(args.table)))
+    finally:
+        if stream is not sys.stdout:
+            stream.close()
+    elapsed = time.perf_counter() - started
+
+    print(f"Exported {count} row(s) from {args.table} in {elapsed:.2f}s "
+          f"({count / elapsed if elapsed else 0:.0f} rows/sec)", file=sys.stderr)
+    return 0
+
+
+def forecast_command(args):
+    """Print days of supply, projected expiry waste and recent flows per blood type"""
+    # Imported here so NumPy is only needed for reporting
+    from analytics import forecast
+
+    print(f"{'type':<5} {'stock ml':>9} {'waste ml':>9} {'in ml/d':>8} {'out ml/d':>9} {'demand/d':>9} "
+          f"{'unmet ml':>9} {'wasted':>7} {'days':>6}  stockout")
+    for f in forecast(args.window):
+        days = f"{f.days_of_supply:.1f}" if f.days_of_supply is not None else '-'
+        print(f"{f.blood_type:<5} {f.stock_ml:>9} {f.projected_waste_ml:>9} {f.donated_ml_per_day:>8.0f} "
+              f"{f.issued_ml_per_day:>9.0f} {f.demand_ml_per_day:>9.0f} {f.unmet_ml:>9} {f.waste_fraction:>7.1%} "
+              f"{days:>6}  {f.stockout_date or '-'}")
+    return 0
+
+
+def check_storage(args):
+    """Run the storage conformance checks against a scratch database"""
+    directory = tempfile.mkdtemp(prefix='blood_bank_conformance_')
+    if args.shards:
+        backend = ShardedSQLiteBackend(directory, args.shards.split(','))
+    else:
+        backend = SQLiteBackend(f'{directory}/blood_bank.db')
+
+    failures = 0
+    for name, error in run_conformance(backend):
+        failures += error is not None
+        print(f"{'FAIL' if error else 'ok  '} {name}" + (f": {error}" if error else ""))
+    print(f"{failures} check(s) failed" if failures else "All checks passed")
+    return 1 if failures else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Blood bank maintenance commands")
+    parser.add_argument('--database', default='blood_bank.db', help="SQLite database file")
+    parser.add_argument('--shard', help="shard to work on (default: every shard)")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('rebuild-summary', help=rebuild_summary.__doc__)
+    command.set_defaults(handler=rebuild_summary)
+
+    command = commands.add_parser('sweep-expired', help=sweep_expired.__doc__)
+    command.add_argument('--purge', action='store_true', help="delete instead of archiving")
+    command.add_argument('--batch-size', type=int, default=500)
+    command.set_defaults(handler=sweep_expired)
+
+    command = commands.add_parser('match-pending', help=match_pending.__doc__)
+    command.set_defaults(handler=match_pending)
+
+    command = commands.add_parser('import-donations', help=import_donations_command.__doc__)
+    command.add_argument('file')
+    command.add_argument('--format', choices=['csv', 'jsonl'])
+    command.add_argument('--batch-size', type=int, default=1000)
+    command.set_defaults(handler=import_donations_command, single_shard=True)
+
+    command = commands.add_parser('export', help=export_command.__doc__)
+    command.add_argument('table', choices=sorted(EXPORT_TABLES))
+    command.add_argument('--output', default='-')
+    command.add_argument('--format', choices=['csv', 'jsonl'])
+    command.set_defaults(handler=export_command, single_shard=True)
+
+    command = commands.add_parser('forecast', help=forecast_command.__doc__)
+    command.add_argument('--window', type=int, default=28, help="days of history to average over")
+    command.set_defaults(handler=forecast_command)
+
+    command = commands.add_parser('check-storage', help=check_storage.__doc__)
+    command.add_argument('--shards', help="comma-separated shard names to check a sharded layout")
+    command.set_defaults(handler=check_storage, scratch=True)
+
+    args = parser.parse_args(argv)
+    if getattr(args, 'scratch', False):
+        return args.handler(args)
+
+    Database.initialize(backend=backend_from_environment(args.database))
+    if args.shard and args.shard not in Database.shards():
+        parser.error(f"unknown shard {args.shard!r}, expected one of {', '.join(Database.shards())}")
+    shards = [args.shard] if args.shard else Database.shards()
+    if getattr(args, 'single_shard', False) and len(shards) > 1:
+        parser.error(f"{args.command} needs --shard with a sharded layout")
+
+    status = 0
+    for shard in shards:
+        if len(shards) > 1:
+            print(f"[{shard}]")
+        with Database.use_shard(shard):
+            status = max(status, args.handler(args))
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,174 @@
+"""Per-statement SQL timing, slow-query log and text exposition
+
+query_stats collects latency histograms and row counts keyed by normalized
+SQL, plus commit/rollback timing and lock waits. Cursors handed out by
+CursorFromConnectionPool only report to it while it is enabled; when it is
+off they are the plain counting cursors and nothing is measured.
+
+Configuration (environment):
+    BLOOD_BANK_QUERY_METRICS   'on' to record statement metrics (default off)
+    BLOOD_BANK_SLOW_QUERY_MS   log statements slower than this (default 100)
+"""
+from functools import lru_cache
+import logging
+import os
+import re
+import threading
+
+slow_query_log = logging.getLogger('blood_bank.slow_query')
+
+# Upper bounds of the latency buckets, in seconds
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+# Statements beyond this many distinct shapes are folded into one series
+MAX_STATEMENTS = 500
+OTHER_STATEMENTS = 'other'
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=1024)
+def normalize_sql(sql):
+    """Statement shape with literals replaced by ? and IN lists collapsed
+
+        normalize_sql("SELECT * FROM t WHERE a IN (?, ?, ?) AND b = 5")
+        -> "SELECT * FROM t WHERE a IN (...) AND b = ?"
+    """
+    sql = _STRING_LITERAL.sub('?', sql)
+    sql = _NUMBER_LITERAL.sub('?', sql)
+    sql = _PLACEHOLDER_LIST.sub('(...)', sql)
+    return _WHITESPACE.sub(' ', sql).strip()
+
+
+class Histogram:
+    """Cumulative latency histogram with a row total"""
+    __slots__ = ('buckets', 'count', 'total', 'rows')
+
+    def __init__(self):
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self.rows = 0
+
+    def observe(self, seconds, rows=0):
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                break
+        self.count += 1
+        self.total += seconds
+        self.rows += rows
+
+
+class QueryStats:
+    """Statement, transaction and lock-wait metrics for the whole process"""
+
+    def __init__(self, enabled=False, slow_threshold=0.1):
+        self.enabled = enabled
+        self.slow_threshold = slow_threshold
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._statements = {}
+            self._transactions = {'commit': Histogram(), 'rollback': Histogram()}
+            self._lock_waits = Histogram()
+            self.busy_errors = 0
+            self.slow_queries = 0
+
+    def record_statement(self, sql, seconds, rows):
+        shape = normalize_sql(sql)
+        with self._lock:
+            histogram = self._statements.get(shape)
+            if histogram is None:
+                if len(self._statements) >= MAX_STATEMENTS:
+                    shape = OTHER_STATEMENTS
+                histogram = self._statements.setdefault(shape, Histogram())
+            histogram.observe(seconds, rows)
+            slow = seconds >= self.slow_threshold
+            if slow:
+                self.slow_queries += 1
+        if slow:
+            slow_query_log.warning("slow query (%.1f ms, %d rows): %s", seconds * 1000, rows, shape)
+
+    def record_lock_wait(self, seconds):
+        """Time a BEGIN IMMEDIATE/EXCLUSIVE spent waiting for the write lock"""
+        with self._lock:
+            self._lock_waits.observe(seconds)
+
+    def record_busy(self):
+        """A statement gave up with SQLITE_BUSY after the busy timeout"""
+        with self._lock:
+            self.busy_errors += 1
+
+    def record_transaction(self, outcome, seconds):
+        with self._lock:
+            self._transactions[outcome].observe(seconds)
+
+    def exposition(self):
+        """Metrics in the Prometheus text format"""
+        with self._lock:
+            lines = [
+                '# HELP blood_bank_sql_statement_seconds Statement latency including row fetching, by normalized SQL',
+                '# TYPE blood_bank_sql_statement_seconds histogram',
+            ]
+            for shape, histogram in sorted(self._statements.items()):
+                lines.extend(_histogram_lines('blood_bank_sql_statement_seconds', histogram, statement=shape))
+            lines += [
+                '# HELP blood_bank_sql_statement_rows Rows returned or changed, by normalized SQL',
+                '# TYPE blood_bank_sql_statement_rows counter',
+            ]
+            for shape, histogram in sorted(self._statements.items()):
+                lines.append(format_sample('blood_bank_sql_statement_rows', histogram.rows, statement=shape))
+            lines += [
+                '# HELP blood_bank_sql_transaction_seconds Time spent in COMMIT and ROLLBACK',
+                '# TYPE blood_bank_sql_transaction_seconds histogram',
+            ]
+            for outcome, histogram in self._transactions.items():
+                lines.extend(_histogram_lines('blood_bank_sql_transaction_seconds', histogram, outcome=outcome))
+            lines += [
+                '# HELP blood_bank_sql_lock_wait_seconds Time BEGIN IMMEDIATE waited for the write lock',
+                '# TYPE blood_bank_sql_lock_wait_seconds histogram',
+            ]
+            lines.extend(_histogram_lines('blood_bank_sql_lock_wait_seconds', self._lock_waits))
+            lines += [
+                '# HELP blood_bank_sql_busy_errors_total Statements that failed with SQLITE_BUSY',
+                '# TYPE blood_bank_sql_busy_errors_total counter',
+                format_sample('blood_bank_sql_busy_errors_total', self.busy_errors),
+                '# HELP blood_bank_sql_slow_queries_total Statements slower than the slow-query threshold',
+                '# TYPE blood_bank_sql_slow_queries_total counter',
+                format_sample('blood_bank_sql_slow_queries_total', self.slow_queries),
+            ]
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_sample(name, value, **labels):
+    """One exposition line, e.g. name{label="value"} 1"""
+    if labels:
+        label_text = ','.join(f'{key}="{_escape(val)}"' for key, val in labels.items())
+        return f'{name}{{{label_text}}} {value}'
+    return f'{name} {value}'
+
+
+def _histogram_lines(name, histogram, **labels):
+    cumulative = 0
+    for bound, count in zip(LATENCY_BUCKETS, histogram.buckets):
+        cumulative += count
+        yield format_sample(f'{name}_bucket', cumulative, **labels, le=bound)
+    yield format_sample(f'{name}_bucket', histogram.count, **labels, le='+Inf')
+    yield format_sample(f'{name}_sum', round(histogram.total, 6), **labels)
+    yield format_sample(f'{name}_count', histogram.count, **labels)
+
+
+query_stats = QueryStats(
+    enabled=os.environ.get('BLOOD_BANK_QUERY_METRICS', 'off').lower() in ('1', 'on', 'true'),
+    slow_threshold=float(os.environ.get('BLOOD_BANK_SLOW_QUERY_MS', 100)) / 1000.0,
+)
@@ -0,0 +1,117 @@
+"""Password hashing off the request threads
+
+Hashes are computed in a bounded pool of worker processes so a burst of
+registrations or logins cannot pin every web worker thread on CPU. At most
+max_pending hashing jobs may be queued or running; callers beyond that wait
+up to wait_timeout seconds for a slot and then get HashingBusyError.
+
+Configuration (environment, read by configure()):
+    BLOOD_BANK_PASSWORD_HASH   werkzeug method, e.g. 'scrypt:32768:8:1' or
+                               'pbkdf2:sha256:600000'
+    BLOOD_BANK_HASH_WORKERS    worker processes; 0 hashes on the calling thread
+    BLOOD_BANK_HASH_PENDING    queued + running jobs allowed (default 4 per worker)
+    BLOOD_BANK_HASH_WAIT       seconds to wait for a free slot (default 5)
+"""
+from concurrent.futures import ProcessPoolExecutor
+from werkzeug.security import check_password_hash, generate_password_hash
+import multiprocessing
+import os
+import threading
+
+DEFAULT_METHOD = 'scrypt:32768:8:1'
+SALT_LENGTH = 16
+
+
+class HashingBusyError(RuntimeError):
+    """Raised when the hashing pool stays full for longer than wait_timeout"""
+
+
+def _hash(password, method):
+    return generate_password_hash(password, method=method, salt_length=SALT_LENGTH)
+
+
+def _verify(stored_hash, password, method):
+    """(matches, new_hash) where new_hash is set if stored_hash should be upgraded"""
+    if not check_password_hash(stored_hash, password):
+        return False, None
+    if stored_hash.split('$', 1)[0] != method:
+        return True, _hash(password, method)
+    return True, None
+
+
+class _Hasher:
+    def __init__(self, method, workers, max_pending, wait_timeout):
+        self.method = method
+        self.workers = workers
+        self.wait_timeout = wait_timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        if workers > 0:
+            # Workers are forked up front, before the app starts its own
+            # threads, and then live for the life of the process
+            context = multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else None
+            self._executor = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+            for future in [self._executor.submit(os.getpid) for _ in range(workers)]:
+                future.result()
+
+    def run(self, function, *args):
+        if self._executor is None:
+            return function(*args)
+        if not self._slots.acquire(timeout=self.wait_timeout):
+            raise HashingBusyError("Password hashing is saturated, try again shortly")
+        try:
+            return self._executor.submit(function, *args).result()
+        finally:
+            self._slots.release()
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+
+
+_hasher = None
+_hasher_lock = threading.Lock()
+
+
+def configure(method=None, workers=None, max_pending=None, wait_timeout=None):
+    """(Re)build the hashing pool; unspecified settings come from the environment"""
+    global _hasher
+    method = method or os.environ.get('BLOOD_BANK_PASSWORD_HASH', DEFAULT_METHOD)
+    if workers is None:
+        workers = int(os.environ.get('BLOOD_BANK_HASH_WORKERS', os.cpu_count() or 1))
+    if max_pending is None:
+        max_pending = int(os.environ.get('BLOOD_BANK_HASH_PENDING', max(workers, 1) * 4))
+    if wait_timeout is None:
+        wait_timeout = float(os.environ.get('BLOOD_BANK_HASH_WAIT', 5))
+
+    with _hasher_lock:
+        previous, _hasher = _hasher, _Hasher(method, workers, max_pending, wait_timeout)
+    if previous is not None:
+        previous.shutdown()
+
+
+def _get_hasher():
+    """The configured hasher; hashes inline until configure() is called"""
+    global _hasher
+    if _hasher is None:
+        with _hasher_lock:
+            if _hasher is None:
+                _hasher = _Hasher(os.environ.get('BLOOD_BANK_PASSWORD_HASH', DEFAULT_METHOD), 0, 1, 0)
+    return _hasher
+
+
+def hash_password(password):
+    """Hash a new password with the configured method"""
+    hasher = _get_hasher()
+    return hasher.run(_hash, password, hasher.method)
+
+
+def verify_password(stored_hash, password):
+    """Check password against stored_hash
+
+    Returns (matches, new_hash). new_hash is a rehash with the configured
+    method when stored_hash used different parameters, for the caller to
+    save; otherwise None.
+    """
+    hasher = _get_hasher()
+    return hasher.run(_verify, stored_hash, password, hasher.method)
@@ -0,0 +1,122 @@
+"""In-memory sliding-window rate limits for logins, registrations and requests
+
+Each SlidingWindowLimiter allows at most limit hits per key in any window
+of window seconds. It keeps two counters per key, for the current and the
+previous fixed window, and weighs the previous one by how much of it still
+overlaps the sliding window, so a check is O(1) and a key costs a few
+dozen bytes however busy it is. Keys live in an LRU of at most max_keys
+entries; the least recently seen key is dropped when it is full, which
+bounds memory under a flood of distinct IPs or emails at the price of
+forgetting the quietest ones.
+
+Limits are per process. Behind several workers each enforces its own.
+
+Configuration (environment), each limit written as HITS/SECONDS:
+    BLOOD_BANK_RATE_LIMITS           'off' to disable every limit (default on)
+    BLOOD_BANK_LOGIN_IP_LIMIT        login POSTs per client IP (default 20/60)
+    BLOOD_BANK_LOGIN_EMAIL_LIMIT     login POSTs per email (default 5/60)
+    BLOOD_BANK_REGISTER_IP_LIMIT     registrations per client IP (default 10/3600)
+    BLOOD_BANK_REGISTER_EMAIL_LIMIT  registrations per email (default 3/3600)
+    BLOOD_BANK_REQUEST_IP_LIMIT      blood requests per client IP (default 10/60)
+    BLOOD_BANK_RATE_LIMIT_KEYS       keys remembered per limit (default 10000)
+"""
+from collections import OrderedDict
+import math
+import os
+import threading
+import time
+
+
+class SlidingWindowLimiter:
+    """At most limit hits per key in any window seconds, for up to max_keys keys"""
+
+    def __init__(self, limit, window, max_keys=10000, enabled=True):
+        self.limit = limit
+        self.window = window
+        self.max_keys = max_keys
+        self.enabled = enabled
+
+        # key -> [window index, hits in that window, hits in the window before]
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.allowed = 0
+        self.throttled = 0
+        self.evictions = 0
+
+    def hit(self, key, now=None):
+        """Count a hit for key; returns 0 if allowed, else seconds until it would be"""
+        if not self.enabled:
+            return 0
+        now = time.monotonic() if now is None else now
+        index, offset = divmod(now, self.window)
+        with self._lock:
+            state = self._keys.get(key)
+            if state is None:
+                state = self._keys[key] = [index, 0, 0]
+                while len(self._keys) > self.max_keys:
+                    self._keys.popitem(last=False)
+                    self.evictions += 1
+            else:
+                self._keys.move_to_end(key)
+                if state[0] != index:
+                    state[2] = state[1] if state[0] == index - 1 else 0
+                    state[0], state[1] = index, 0
+
+            previous_weight = 1 - offset / self.window
+            estimate = state[1] + 1 + state[2] * previous_weight
+            if estimate <= self.limit:
+                state[1] += 1
+                self.allowed += 1
+                return 0
+            self.throttled += 1
+
+            # Wait for enough of the previous window to slide out, or at most
+            # until the current window rolls over
+            until_rollover = self.window - offset
+            if state[2] and state[1] < self.limit:
+                until_rollover = min(until_rollover, (estimate - self.limit) / state[2] * self.window)
+            return max(1, math.ceil(until_rollover))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'keys': len(self._keys),
+                'max_keys': self.max_keys,
+                'allowed': self.allowed,
+                'throttled': self.throttled,
+                'evictions': self.evictions,
+            }
+
+
+def _limit_from_environment(name, default, max_keys, enabled):
+    hits, seconds = os.environ.get(name, default).split('/')
+    return SlidingWindowLimiter(int(hits), float(seconds), max_keys, enabled)
+
+
+_enabled = os.environ.get('BLOOD_BANK_RATE_LIMITS', 'on').lower() not in ('0', 'off', 'false')
+_max_keys = int(os.environ.get('BLOOD_BANK_RATE_LIMIT_KEYS', 10000))
+
+# One limiter per rule, by name as reported in /metrics
+limiters = {
+    'login_ip': _limit_from_environment('BLOOD_BANK_LOGIN_IP_LIMIT', '20/60', _max_keys, _enabled),
+    'login_email': _limit_from_environment('BLOOD_BANK_LOGIN_EMAIL_LIMIT', '5/60', _max_keys, _enabled),
+    'register_ip': _limit_from_environment('BLOOD_BANK_REGISTER_IP_LIMIT', '10/3600', _max_keys, _enabled),
+    'register_email': _limit_from_environment('BLOOD_BANK_REGISTER_EMAIL_LIMIT', '3/3600', _max_keys, _enabled),
+    'request_ip': _limit_from_environment('BLOOD_BANK_REQUEST_IP_LIMIT', '10/60', _max_keys, _enabled),
+}
+
+
+def check(*rules):
+    """Count a hit against each (limiter name, key) in order
+
+    Stops at the first limit that is exceeded, so a throttled hit is not
+    counted against the rules after it. Returns 0 if every rule allowed
+    the hit, else the seconds to wait before retrying.
+    """
+    for name, key in rules:
+        retry_after = limiters[name].hit(key)
+        if retry_after:
+            return retry_after
+    return 0
@@ -0,0 +1,201 @@
+"""Data access for the routes
+
+Every method takes the caller's cursor, so a route can fetch everything a
+page needs inside one CursorFromConnectionPool block (one connection
+checkout, one commit) instead of each helper opening its own.
+"""
+from collections import namedtuple
+import datetime
+
+# Row types with explicit column lists; password hashes are never loaded
+# for pages. history_version changes whenever the person's donation or
+# request history does (see migration 4).
+DonorProfile = namedtuple('DonorProfile', ['id', 'name', 'email', 'blood_type', 'phone', 'address',
+                                           'last_donation_date', 'history_version'])
+RecipientProfile = namedtuple('RecipientProfile', ['id', 'name', 'email', 'blood_type', 'phone', 'address',
+                                                   'medical_condition', 'last_request_date', 'history_version'])
+Donation = namedtuple('Donation', ['id', 'blood_type', 'quantity_ml', 'collection_date', 'expiry_date'])
+BloodRequest = namedtuple('BloodRequest', ['id', 'blood_type', 'quantity_ml', 'request_date', 'status'])
+
+HISTORY_PAGE_SIZE = 20
+
+DONATION_INTERVAL_DAYS = 60
+REQUEST_INTERVAL_DAYS = 40
+SHELF_LIFE_DAYS = 42  # Blood typically expires in 42 days
+# Accepted volume of one donation, in ml
+DONATION_MIN_ML = 100
+DONATION_MAX_ML = 500
+
+
+def _next_allowed_date(last_date, interval_days):
+    """Date from which the action is allowed again, or None if it already is"""
+    if not last_date:
+        return None
+    if isinstance(last_date, str):
+        last_date = datetime.datetime.strptime(last_date, '%Y-%m-%d').date()
+    next_date = last_date + datetime.timedelta(days=interval_days)
+    return next_date if next_date > datetime.date.today() else None
+
+
+def _split_page(rows, row_type, limit):
+    """Turn history rows into (page, next_page)
+
+    The query fetched limit + 1 rows so a further page can be detected
+    without a COUNT; next_page is the (date, id) keyset of the last row
+    shown, or None on the last page.
+    """
+    page = [row_type._make(row) for row in rows]
+    next_page = None
+    if len(page) > limit:
+        page = page[:limit]
+        next_page = (page[-1][3], page[-1].id)
+    return page, next_page
+
+
+def next_donation_date(last_donation_date):
+    """When a donor who last gave on last_donation_date may give again (None = now)"""
+    return _next_allowed_date(last_donation_date, DONATION_INTERVAL_DAYS)
+
+
+def next_request_date(last_request_date):
+    """When a recipient who last asked on last_request_date may ask again (None = now)"""
+    return _next_allowed_date(last_request_date, REQUEST_INTERVAL_DAYS)
+
+
+class DonorRepo:
+    """Queries on donors"""
+
+    @staticmethod
+    def create(cursor, name, email, password_hash, blood_type, phone, address):
+        """Insert a donor and return its id"""
+        cursor.execute(
+            "INSERT INTO donors (name, email, password, blood_type, phone, address) VALUES (?, ?, ?, ?, ?, ?)",
+            (name, email, password_hash, blood_type, phone, address)
+        )
+        return cursor.lastrowid
+
+    @staticmethod
+    def find_login(cursor, email):
+        """(id, name, password_hash) for email, or None"""
+        cursor.execute("SELECT id, name, password FROM donors WHERE email = ?", (email,))
+        return cursor.fetchone()
+
+    @staticmethod
+    def update_password(cursor, donor_id, password_hash):
+        cursor.execute("UPDATE donors SET password = ? WHERE id = ?", (password_hash, donor_id))
+
+    @staticmethod
+    def donation_profile(cursor, donor_id):
+        """(blood_type, last_donation_date) for a donor, or None"""
+        cursor.execute("SELECT blood_type, last_donation_date FROM donors WHERE id = ?", (donor_id,))
+        return cursor.fetchone()
+
+    @staticmethod
+    def record_donation(cursor, donor_id, donation_date):
+        cursor.execute("UPDATE donors SET last_donation_date = ? WHERE id = ?", (donation_date, donor_id))
+
+    @staticmethod
+    def profile(cursor, donor_id):
+        """DonorProfile for the dashboard, or None if the id is unknown"""
+        cursor.execute("""
+            SELECT id, name, email, blood_type, phone, address, last_donation_date, history_version
+            FROM donors WHERE id = ?
+        """, (donor_id,))
+        row = cursor.fetchone()
+        return row and DonorProfile._make(row)
+
+    @staticmethod
+    def donations(cursor, donor_id, before=None, limit=HISTORY_PAGE_SIZE):
+        """(donations, next_page): one page of the donor's units, newest first
+
+        Units already swept into blood_bank_expired are included. The page
+        starts after the (collection_date, id) keyset before; next_page is
+        the keyset for the following page or None.
+        """
+        keyset = "AND (collection_date, id) < (?, ?)" if before else ""
+        params = (donor_id,) + tuple(before or ())
+        # Both halves are read in index order and merged
+        cursor.execute(f"""
+            SELECT id, blood_type, quantity_ml, collection_date, expiry_date
+            FROM blood_bank
+            WHERE donor_id = ? {keyset}
+            UNION ALL
+            SELECT id, blood_type, quantity_ml, collection_date, expiry_date
+            FROM blood_bank_expired
+            WHERE donor_id = ? {keyset}
+            ORDER BY collection_date DESC, id DESC
+            LIMIT ?
+        """, params + params + (limit + 1,))
+        return _split_page(cursor.fetchall(), Donation, limit)
+
+
+class RecipientRepo:
+    """Queries on recipients"""
+
+    @staticmethod
+    def create(cursor, name, email, password_hash, blood_type, phone, address, medical_condition):
+        """Insert a recipient and return its id"""
+        cursor.execute(
+            "INSERT INTO recipients (name, email, password, blood_type, phone, address, medical_condition) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (name, email, password_hash, blood_type, phone, address, medical_condition)
+        )
+        return cursor.lastrowid
+
+    @staticmethod
+    def find_login(cursor, email):
+        """(id, name, password_hash) for email, or None"""
+        cursor.execute("SELECT id, name, password FROM recipients WHERE email = ?", (email,))
+        return cursor.fetchone()
+
+    @staticmethod
+    def update_password(cursor, recipient_id, password_hash):
+        cursor.execute("UPDATE recipients SET password = ? WHERE id = ?", (password_hash, recipient_id))
+
+    @staticmethod
+    def request_profile(cursor, recipient_id):
+        """(blood_type, last_request_date) for a recipient, or None"""
+        cursor.execute("SELECT blood_type, last_request_date FROM recipients WHERE id = ?", (recipient_id,))
+        return cursor.fetchone()
+
+    @staticmethod
+    def profile(cursor, recipient_id):
+        """RecipientProfile for the dashboard, or None if the id is unknown"""
+        cursor.execute("""
+            SELECT id, name, email, blood_type, phone, address, medical_condition, last_request_date,
+                   history_version
+            FROM recipients WHERE id = ?
+        """, (recipient_id,))
+        row = cursor.fetchone()
+        return row and RecipientProfile._make(row)
+
+    @staticmethod
+    def requests(cursor, recipient_id, before=None, limit=HISTORY_PAGE_SIZE):
+        """(requests, next_page): one page of the recipient's blood requests, newest first
+
+        The page starts after the (request_date, id) keyset before;
+        next_page is the keyset for the following page or None.
+        """
+        keyset = "AND (request_date, id) < (?, ?)" if before else ""
+        cursor.execute(f"""
+            SELECT id, blood_type, quantity_ml, request_date, status
+            FROM blood_requests
+            WHERE recipient_id = ? {keyset}
+            ORDER BY request_date DESC, id DESC
+            LIMIT ?
+        """, (recipient_id,) + tuple(before or ()) + (limit + 1,))
+        return _split_page(cursor.fetchall(), BloodRequest, limit)
+
+
+class InventoryRepo:
+    """Queries on blood_bank"""
+
+    @staticmethod
+    def add_unit(cursor, blood_type, quantity_ml, donor_id, collection_date=None):
+        """Insert a unit expiring SHELF_LIFE_DAYS after collection and return its id"""
+        collection_date = collection_date or datetime.date.today()
+        expiry_date = collection_date + datetime.timedelta(days=SHELF_LIFE_DAYS)
+        cursor.execute(
+            "INSERT INTO blood_bank (blood_type, quantity_ml, donor_id, collection_date, expiry_date) VALUES (?, ?, ?, ?, ?)",
+            (blood_type, quantity_ml, donor_id, collection_date, expiry_date)
+        )
+        return cursor.lastrowid
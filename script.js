@@ -101,6 +101,31 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
     
+    // Live stock on the recipient dashboard
+    const inventoryPanel = document.querySelector('[data-inventory-stream]');
+    if (inventoryPanel && window.EventSource) {
+        const amount = inventoryPanel.querySelector('.available-ml');
+        const source = new EventSource(inventoryPanel.dataset.inventoryStream);
+        
+        const update = function(event) {
+            const stock = JSON.parse(event.data).compatible_available_ml;
+            // Crossing zero swaps the request form in or out, so re-render
+            if (!amount !== !stock) {
+                source.close();
+                window.location.reload();
+                return;
+            }
+            if (amount) {
+                amount.textContent = stock;
+                if (quantityInput) {
+                    quantityInput.max = stock;
+                }
+            }
+        };
+        source.addEventListener('snapshot', update);
+        source.addEventListener('inventory', update);
+    }
+    
     // Add current date to footer
     const footerYear = document.querySelector('footer p');
     if (footerYear) {
@@ -0,0 +1,46 @@
+import os
+import sys
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+
+@pytest.fixture
+def database(tmp_path):
+    """A fresh, fully migrated database in a temporary file"""
+    from database import Database
+
+    Database.initialize(str(tmp_path / 'blood_bank.db'), pool_size=2)
+    return Database
+
+
+@pytest.fixture(scope='session')
+def app_module(tmp_path_factory):
+    """The Flask app, imported inside a scratch directory with background work off"""
+    os.environ.setdefault('BLOOD_BANK_HOUSEKEEPING_INTERVAL', '0')
+    os.environ.setdefault('BLOOD_BANK_HASH_WORKERS', '0')
+    os.environ.setdefault('BLOOD_BANK_RATE_LIMITS', 'off')
+    os.environ.setdefault('BLOOD_BANK_PASSWORD_HASH', 'pbkdf2:sha256:1000')
+    previous = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp('app'))
+    try:
+        import app
+    finally:
+        os.chdir(previous)
+    if not os.path.isdir(os.path.join(REPO_ROOT, 'templates')):
+        # Checkouts keep the templates next to the modules
+        from jinja2 import FileSystemLoader
+        app.app.jinja_loader = FileSystemLoader(REPO_ROOT)
+    app.app.testing = True
+    return app
+
+
+@pytest.fixture
+def client(app_module, database, monkeypatch):
+    """Test client on a fresh database, with every cache off so query counts are stable"""
+    monkeypatch.setattr(app_module.availability_cache, 'enabled', False)
+    monkeypatch.setattr(app_module.snapshot_cache, 'enabled', False)
+    monkeypatch.setattr(app_module.fragment_cache, 'enabled', False)
+    return app_module.app.test_client()
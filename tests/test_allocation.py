@@ -0,0 +1,51 @@
+import datetime
+
+from database import CursorFromConnectionPool
+from inventory import allocate_units, stock_by_type
+
+TODAY = datetime.date.today()
+
+
+def add_units(cursor, blood_type, *expiring_in_days):
+    unit_ids = []
+    for days in expiring_in_days:
+        cursor.execute(
+            "INSERT INTO blood_bank (blood_type, quantity_ml, donor_id, collection_date, expiry_date) VALUES (?, 450, NULL, ?, ?)",
+            (blood_type, TODAY, TODAY + datetime.timedelta(days=days))
+        )
+        unit_ids.append(cursor.lastrowid)
+    return unit_ids
+
+
+def test_spill_over_drains_own_type_then_takes_soonest_expiring_units(database):
+    with CursorFromConnectionPool() as cursor:
+        own = add_units(cursor, 'A+', 30, 10)
+        plentiful = add_units(cursor, 'O+', 20, 5, 40)
+        scarce = add_units(cursor, 'A-', 1)
+
+    with CursorFromConnectionPool() as cursor:
+        cursor.execute("BEGIN IMMEDIATE")
+        unit_ids = allocate_units(cursor, 'A+', 1200, TODAY, policy='exact_first')
+
+    # Both A+ units, then the soonest-expiring O+ unit, which is split
+    assert sorted(unit_ids) == sorted(own + [plentiful[1]])
+    with CursorFromConnectionPool() as cursor:
+        cursor.execute("SELECT id, quantity_ml FROM blood_bank ORDER BY id")
+        left = dict(cursor.fetchall())
+        stock = stock_by_type(cursor, ['A+', 'O+', 'A-'], TODAY)
+    assert left == {plentiful[0]: 450, plentiful[1]: 150, plentiful[2]: 450, scarce[0]: 450}
+    assert stock == {'O+': 1050, 'A-': 450}
+
+
+def test_allocation_that_cannot_be_covered_changes_nothing(database):
+    with CursorFromConnectionPool() as cursor:
+        add_units(cursor, 'A+', 30, 10)
+        add_units(cursor, 'O+', 20)
+
+    with CursorFromConnectionPool() as cursor:
+        cursor.execute("BEGIN IMMEDIATE")
+        assert allocate_units(cursor, 'A+', 1500, TODAY, policy='exact_first') is None
+
+    with CursorFromConnectionPool() as cursor:
+        cursor.execute("SELECT COUNT(*), SUM(quantity_ml) FROM blood_bank")
+        assert cursor.fetchone() == (3, 1350)
@@ -0,0 +1,45 @@
+import pytest
+
+from compatibility import BLOOD_TYPES, COMPATIBLE_DONORS, COMPATIBLE_RECIPIENTS, preference_order
+
+# Red cell donors for each recipient type, written out by hand
+EXPECTED_DONORS = {
+    'O-': ('O-',),
+    'O+': ('O-', 'O+'),
+    'A-': ('O-', 'A-'),
+    'A+': ('O-', 'O+', 'A-', 'A+'),
+    'B-': ('O-', 'B-'),
+    'B+': ('O-', 'O+', 'B-', 'B+'),
+    'AB-': ('O-', 'A-', 'B-', 'AB-'),
+    'AB+': BLOOD_TYPES,
+}
+
+
+def test_compatible_donors_table():
+    assert COMPATIBLE_DONORS == EXPECTED_DONORS
+
+
+def test_compatible_recipients_is_the_reverse_table():
+    for donor in BLOOD_TYPES:
+        assert set(COMPATIBLE_RECIPIENTS[donor]) == {r for r, donors in EXPECTED_DONORS.items() if donor in donors}
+
+
+@pytest.mark.parametrize('recipient', BLOOD_TYPES)
+def test_preference_order_starts_with_own_type_and_covers_every_donor(recipient):
+    order = preference_order(recipient, {})
+    assert order[0] == recipient
+    assert sorted(order) == sorted(EXPECTED_DONORS[recipient])
+
+
+@pytest.mark.parametrize('recipient', BLOOD_TYPES)
+def test_equal_stock_draws_o_negative_last_and_o_positive_just_before(recipient):
+    order = preference_order(recipient, {t: 4500 for t in BLOOD_TYPES})
+    if recipient != 'O-':
+        assert order[-1] == 'O-'
+    if recipient.endswith('+') and recipient != 'O+':
+        assert order[-2] == 'O+'
+
+
+def test_preference_order_uses_plentiful_stock_before_scarce():
+    stock = {'AB+': 0, 'O-': 9000, 'A+': 450, 'B+': 2000, 'O+': 2000}
+    assert preference_order('AB+', stock) == ['AB+', 'O-', 'B+', 'O+', 'A+', 'AB-', 'B-', 'A-']
@@ -0,0 +1,18 @@
+"""The storage conformance suite (manage.py check-storage) under pytest"""
+import pytest
+
+from conformance import run_conformance
+from database import ShardedSQLiteBackend, SQLiteBackend
+
+BACKENDS = {
+    'single': lambda directory: SQLiteBackend(str(directory / 'blood_bank.db')),
+    'sharded': lambda directory: ShardedSQLiteBackend(str(directory), ['north', 'south']),
+}
+
+
+@pytest.mark.parametrize('layout', BACKENDS)
+def test_backend_passes_every_conformance_check(layout, tmp_path):
+    results = list(run_conformance(BACKENDS[layout](tmp_path)))
+    assert results
+    failures = {name: repr(error) for name, error in results if error is not None}
+    assert failures == {}
@@ -0,0 +1,21 @@
+from database import CursorFromConnectionPool, Database
+
+
+def test_connection_returns_to_the_pool_it_came_from_after_reinitialize(tmp_path):
+    Database.initialize(str(tmp_path / 'old.db'), pool_size=1)
+    old_pool = Database.pool()
+    with CursorFromConnectionPool() as cursor:
+        cursor.execute("SELECT 1")
+        Database.initialize(str(tmp_path / 'new.db'), pool_size=1)
+        new_pool = Database.pool()
+        new_before = new_pool.stats()
+
+    # The old pool is closed, so its connection was closed and counted out,
+    # and the new pool did not gain a connection it never opened
+    assert old_pool.stats()['open'] == 0
+    assert new_pool.stats()['open'] == new_before['open'] <= 1
+    assert new_pool.stats()['idle'] == new_before['idle']
+
+    with CursorFromConnectionPool() as cursor:
+        cursor.execute("PRAGMA database_list")
+        assert cursor.fetchone()[2].endswith('new.db')
@@ -0,0 +1,23 @@
+import json
+
+from database import CursorFromConnectionPool
+from events import InventoryBroker
+from repositories import InventoryRepo
+
+
+def test_o_negative_donation_reaches_ab_positive_as_a_compatible_change(database):
+    broker = InventoryBroker()
+    shard = database.current_shard()
+    broker.subscribe(shard)
+    broker.prime(shard)
+
+    with CursorFromConnectionPool() as cursor:
+        InventoryRepo.add_unit(cursor, 'O-', 450, None)
+    broker.publish()
+
+    events = {blood_type: json.loads(data) for _, _, blood_type, data in broker.wait(0, 0)}
+    assert events['O-']['delta_ml'] == 450
+    assert events['O-']['compatible_delta_ml'] == 450
+    assert events['AB+']['delta_ml'] == 0
+    assert events['AB+']['compatible_delta_ml'] == 450
+    assert events['AB+']['compatible_available_ml'] == 450
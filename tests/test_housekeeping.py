@@ -0,0 +1,31 @@
+import housekeeping
+from housekeeping import Housekeeper
+
+
+def test_sweeps_keep_their_interval_while_stock_keeps_arriving(database, monkeypatch):
+    runs = []
+    monkeypatch.setattr(housekeeping, 'sweep_expired_units', lambda batch_size: runs.append('sweep') or 0)
+    monkeypatch.setattr(housekeeping, 'match_pending_requests', lambda: runs.append('match') or [])
+
+    housekeeper = Housekeeper(interval=0.5)
+    housekeeper._last_sweep = 0.0
+    # A donation notice every 0.2s for 5s wakes the thread 25 times
+    for tick in range(1, 26):
+        housekeeper.run_jobs(now=tick * 0.2)
+
+    assert runs.count('match') == 25
+    # Due at 0.6, 1.2, 1.8, ... 4.8: one sweep per 0.6s of wake-ups
+    assert runs.count('sweep') == 8
+
+
+def test_wake_up_before_the_interval_only_matches(database, monkeypatch):
+    runs = []
+    monkeypatch.setattr(housekeeping, 'sweep_expired_units', lambda batch_size: runs.append('sweep') or 0)
+    monkeypatch.setattr(housekeeping, 'match_pending_requests', lambda: runs.append('match') or [])
+
+    housekeeper = Housekeeper(interval=300.0)
+    housekeeper._last_sweep = 1000.0
+    housekeeper.run_jobs(now=1010.0)
+    assert runs == ['match']
+    housekeeper.run_jobs(now=1300.0)
+    assert runs == ['match', 'sweep', 'match']
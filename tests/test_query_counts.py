@@ -0,0 +1,76 @@
+"""SQL statements per request, from the X-SQL-Statements header
+
+Transaction control and trigger statements are not counted. A change that
+adds a round trip to one of these routes has to update the number here.
+"""
+from database import CursorFromConnectionPool
+from repositories import DonorRepo, InventoryRepo, RecipientRepo
+
+
+def statements(response):
+    return int(response.headers['X-SQL-Statements'])
+
+
+def table_count(table):
+    with CursorFromConnectionPool() as cursor:
+        cursor.execute(f"SELECT COUNT(*) FROM {table}")
+        return cursor.fetchone()[0]
+
+
+def log_in(client, role, person_id):
+    with client.session_transaction() as session:
+        session[f'{role}_id'] = person_id
+        session[f'{role}_name'] = role.title()
+
+
+def create_donor():
+    with CursorFromConnectionPool() as cursor:
+        donor_id = DonorRepo.create(cursor, 'Donor', 'donor@example.com', 'x', 'O+', '0', '-')
+        InventoryRepo.add_unit(cursor, 'O+', 450, donor_id)
+    return donor_id
+
+
+def create_recipient():
+    with CursorFromConnectionPool() as cursor:
+        recipient_id = RecipientRepo.create(cursor, 'Recipient', 'recipient@example.com', 'x', 'O+', '0', '-', None)
+        for _ in range(3):
+            InventoryRepo.add_unit(cursor, 'O+', 450, None)
+    return recipient_id
+
+
+def test_donor_dashboard(client):
+    log_in(client, 'donor', create_donor())
+    response = client.get('/donor/dashboard')
+    assert response.status_code == 200
+    # Profile and one page of donations
+    assert statements(response) == 2
+
+
+def test_donate(client):
+    with CursorFromConnectionPool() as cursor:
+        donor_id = DonorRepo.create(cursor, 'Donor', 'donor@example.com', 'x', 'O+', '0', '-')
+    log_in(client, 'donor', donor_id)
+    response = client.post('/donor/donate', data={'quantity_ml': '450'})
+    assert response.status_code == 302
+    # Eligibility, last_donation_date and the new unit
+    assert statements(response) == 3
+    assert table_count('blood_bank') == 1
+
+
+def test_recipient_dashboard(client):
+    log_in(client, 'recipient', create_recipient())
+    response = client.get('/recipient/dashboard')
+    assert response.status_code == 200
+    # Profile, one page of requests and compatible stock
+    assert statements(response) == 3
+
+
+def test_request(client):
+    log_in(client, 'recipient', create_recipient())
+    response = client.post('/recipient/request', data={'quantity_ml': '600'})
+    assert response.status_code == 302
+    # Eligibility, stock, units, the debit (one unit used up, one split),
+    # the request row and last_request_date
+    assert statements(response) == 7
+    assert table_count('blood_requests') == 1
+
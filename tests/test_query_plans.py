@@ -0,0 +1,116 @@
+"""EXPLAIN QUERY PLAN checks for the hot queries
+
+Each test runs the real code path with a trace callback on the connection,
+then asks SQLite how it would execute the SELECTs it saw. A plan that
+stops using its index, or starts sorting, fails here.
+"""
+import datetime
+
+from database import CursorFromConnectionPool
+from housekeeping import sweep_expired_units
+from inventory import allocate_units
+from repositories import DonorRepo, InventoryRepo, RecipientRepo
+
+TODAY = datetime.date.today()
+
+
+def traced_selects(call):
+    """SELECT statements (with parameters bound) run by call(cursor)"""
+    statements = []
+    with CursorFromConnectionPool() as cursor:
+        cursor.connection.set_trace_callback(statements.append)
+        try:
+            call(cursor)
+        finally:
+            cursor.connection.set_trace_callback(None)
+    return [sql for sql in statements if sql.lstrip().upper().startswith('SELECT')]
+
+
+def query_plan(sql):
+    with CursorFromConnectionPool() as cursor:
+        cursor.execute("EXPLAIN QUERY PLAN " + sql)
+        return [row[3] for row in cursor.fetchall()]
+
+
+def plans_for(call, table):
+    """Plans of every traced SELECT that reads table"""
+    return [query_plan(sql) for sql in traced_selects(call) if f"FROM {table}" in sql]
+
+
+def plan_for(call, table):
+    """Plan of the one traced SELECT that reads table"""
+    plans = plans_for(call, table)
+    assert len(plans) == 1, plans
+    return plans[0]
+
+
+def seed_people_and_stock():
+    with CursorFromConnectionPool() as cursor:
+        donor_id = DonorRepo.create(cursor, 'Donor', 'donor@example.com', 'x', 'O+', '0', '-')
+        recipient_id = RecipientRepo.create(cursor, 'Recipient', 'recipient@example.com', 'x', 'A+', '0', '-', None)
+        for blood_type in ('O-', 'O+', 'A-', 'A+'):
+            for _ in range(3):
+                InventoryRepo.add_unit(cursor, blood_type, 450, donor_id)
+    return donor_id, recipient_id
+
+
+def assert_uses_index(plan, index):
+    assert any(f"INDEX {index} " in step for step in plan), plan
+    assert not any(step.startswith('SCAN') for step in plan), plan
+
+
+def test_allocation_seeks_the_type_expiry_index(database):
+    seed_people_and_stock()
+    plan = plan_for(lambda cursor: allocate_units(cursor, 'A+', 900, TODAY, policy='exact_only'), 'blood_bank')
+    assert_uses_index(plan, 'idx_blood_bank_type_expiry')
+    assert not any('TEMP B-TREE' in step for step in plan), plan
+
+
+def test_allocation_across_types_seeks_the_type_expiry_index(database):
+    seed_people_and_stock()
+    # A+ is drained whole and the rest comes from the next type by expiry
+    plans = plans_for(lambda cursor: allocate_units(cursor, 'A+', 2000, TODAY, policy='exact_first'), 'blood_bank')
+    assert len(plans) == 2, plans
+    for plan in plans:
+        assert_uses_index(plan, 'idx_blood_bank_type_expiry')
+        assert not any('TEMP B-TREE' in step for step in plan), plan
+
+
+def test_earliest_expiry_allocation_walks_the_expiry_index(database):
+    seed_people_and_stock()
+    plan = plan_for(lambda cursor: allocate_units(cursor, 'A+', 2000, TODAY, policy='earliest_expiry'), 'blood_bank')
+    assert_uses_index(plan, 'idx_blood_bank_expiry')
+    assert not any('TEMP B-TREE' in step for step in plan), plan
+
+
+def test_donor_history_merges_live_and_archived_units_by_index(database):
+    donor_id, _ = seed_people_and_stock()
+    for before in (None, (TODAY.isoformat(), 5)):
+        plan = plan_for(lambda cursor: DonorRepo.donations(cursor, donor_id, before), 'blood_bank')
+        assert_uses_index(plan, 'idx_blood_bank_donor')
+        assert_uses_index(plan, 'idx_blood_bank_expired_donor')
+        assert 'MERGE (UNION ALL)' in plan
+        assert not any('TEMP B-TREE' in step for step in plan), plan
+
+
+def test_request_history_seeks_the_recipient_index(database):
+    _, recipient_id = seed_people_and_stock()
+    for before in (None, (TODAY.isoformat(), 5)):
+        plan = plan_for(lambda cursor: RecipientRepo.requests(cursor, recipient_id, before), 'blood_requests')
+        assert_uses_index(plan, 'idx_blood_requests_recipient')
+        assert not any('TEMP B-TREE' in step for step in plan), plan
+
+
+def test_sweep_walks_the_expiry_index(database):
+    seed_people_and_stock()
+    plan = plan_for(lambda cursor: sweep_expired_units(), 'blood_bank')
+    assert_uses_index(plan, 'idx_blood_bank_expiry')
+    assert not any('TEMP B-TREE' in step for step in plan), plan
+
+
+def test_unused_collection_order_index_is_dropped(database):
+    with CursorFromConnectionPool() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'blood_bank'")
+        indexes = {row[0] for row in cursor.fetchall()}
+    assert 'idx_blood_bank_type_collection' not in indexes
+    assert 'idx_blood_bank_type_expiry' in indexes
@@ -0,0 +1,117 @@
+"""Donation and request writes through the routes and the group-commit writer"""
+from concurrent.futures import Future
+import threading
+
+import pytest
+
+from database import CursorFromConnectionPool
+from repositories import DonorRepo
+import writer
+
+
+def create_donor():
+    with CursorFromConnectionPool() as cursor:
+        return DonorRepo.create(cursor, 'Donor', 'donor@example.com', 'x', 'O+', '0', '-')
+
+
+def donate(client, quantity_ml):
+    with client.session_transaction() as session:
+        session['donor_id'] = create_donor()
+        session['donor_name'] = 'Donor'
+    return client.post('/donor/donate', data={'quantity_ml': quantity_ml}, follow_redirects=True)
+
+
+def units():
+    with CursorFromConnectionPool() as cursor:
+        cursor.execute("SELECT quantity_ml FROM blood_bank")
+        return [row[0] for row in cursor.fetchall()]
+
+
+@pytest.mark.parametrize('quantity_ml', ['abc', '', '-5000', '0', '99', '501', '450.5'])
+def test_donation_outside_the_accepted_range_is_refused(client, quantity_ml):
+    response = donate(client, quantity_ml)
+    assert response.status_code == 200
+    assert b'Please enter a donation between 100 and 500 ml.' in response.data
+    assert units() == []
+
+
+def test_donation_is_stored_as_an_integer(client):
+    response = donate(client, '450')
+    assert b'Thank you for your donation!' in response.data
+    assert units() == [450]
+
+
+@pytest.mark.parametrize('quantity_ml', ['abc', -5000, 501])
+def test_record_donation_rejects_bad_quantities(app_module, database, quantity_ml):
+    donor_id = create_donor()
+    with CursorFromConnectionPool() as cursor:
+        with pytest.raises(ValueError):
+            app_module.record_donation(cursor, donor_id, quantity_ml)
+    assert units() == []
+
+
+@pytest.fixture
+def batching(database):
+    """Group commit on, holding each batch open long enough for a test's writes to join it"""
+    writer.configure(enabled=True, max_batch=3, max_delay=0.5)
+    yield writer.current_writer()
+    writer.configure(enabled=False)
+
+
+def add_unit(cursor, quantity_ml):
+    cursor.execute(
+        "INSERT INTO blood_bank (blood_type, quantity_ml, collection_date, expiry_date) VALUES ('O+', ?, date('now'), date('now', '+42 days'))",
+        (quantity_ml,)
+    )
+    return quantity_ml
+
+
+def add_unit_then_fail(cursor, quantity_ml):
+    add_unit(cursor, quantity_ml)
+    raise ValueError("no")
+
+
+def test_failing_write_in_a_batch_rolls_back_only_its_own_savepoint(batching):
+    futures = [
+        writer.submit(add_unit, 100),
+        writer.submit(add_unit_then_fail, 200),
+        writer.submit(add_unit, 300),
+    ]
+    assert futures[0].result(5) == 100
+    with pytest.raises(ValueError):
+        futures[1].result(5)
+    assert futures[2].result(5) == 300
+    assert batching.stats()['batches'] == 1
+    assert sorted(units()) == [100, 300]
+
+
+def test_timed_out_write_stays_queued_and_commits_later(batching):
+    release = threading.Event()
+
+    def slow_add_unit(cursor, quantity_ml):
+        release.wait(5)
+        return add_unit(cursor, quantity_ml)
+
+    with pytest.raises(writer.WriteTimeoutError) as raised:
+        writer.execute(slow_add_unit, 450, timeout=0.05)
+    release.set()
+    assert raised.value.future.result(5) == 450
+    assert units() == [450]
+
+
+def test_donation_that_times_out_is_reported_and_finished_later(client, app_module, monkeypatch):
+    future = Future()
+
+    def timed_out(operation, *args):
+        raise writer.WriteTimeoutError(future)
+
+    changed = []
+    monkeypatch.setattr(app_module, 'execute_write', timed_out)
+    monkeypatch.setattr(app_module, 'stock_changed', changed.append)
+
+    response = donate(client, '450')
+    assert response.status_code == 200
+    assert b'taking longer than usual' in response.data
+    assert changed == []
+    future.set_result('O+')
+    assert changed == ['O+']
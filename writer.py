@@ -0,0 +1,212 @@
+"""Group commit for donation and request writes
+
+With batching on, one writer thread owns every donation and request write.
+It applies everything that queued up while its previous commit was running
+(up to max_batch operations) in a single BEGIN IMMEDIATE transaction per
+shard, so a burst of writes pays for one commit and one fsync instead of
+one each. max_delay optionally holds a batch open a little longer for more
+writes to join; an idle writer commits a lone write straight away.
+Every operation runs under its own savepoint: one that raises is rolled
+back alone and only its caller sees the error.
+
+Callers get a concurrent.futures.Future from submit(); execute() waits for
+it. With batching off (the default) both run the operation in its own
+transaction on the calling thread, exactly as before. A queued write that
+execute() gives up on stays queued and may still commit; WriteTimeoutError
+carries its future so the caller can finish the job when it does.
+
+Configuration (environment, read by configure()):
+    BLOOD_BANK_WRITE_BATCHING   'on' to start the writer thread (default off)
+    BLOOD_BANK_WRITE_BATCH      most operations per transaction (default 64)
+    BLOOD_BANK_WRITE_DELAY_MS   longest an operation waits for others to
+                                join its batch (default 0)
+"""
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from database import CursorFromConnectionPool, Database
+import logging
+import os
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Seconds execute() waits for a queued write before giving up on it
+RESULT_TIMEOUT = 30.0
+
+
+class WriteTimeoutError(RuntimeError):
+    """Raised when a queued write outlasts execute()'s timeout; it may still commit later"""
+
+    def __init__(self, future):
+        super().__init__("The write is still queued")
+        self.future = future
+
+
+def _apply_now(operation, args):
+    future = Future()
+    try:
+        with CursorFromConnectionPool() as cursor:
+            cursor.execute("BEGIN IMMEDIATE")
+            result = operation(cursor, *args)
+    except Exception as e:
+        future.set_exception(e)
+    else:
+        future.set_result(result)
+    return future
+
+
+class GroupCommitWriter(threading.Thread):
+    """Writer thread that applies queued operations in batched transactions"""
+
+    def __init__(self, max_batch=64, max_delay=0.0):
+        super().__init__(name='group-commit-writer', daemon=True)
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue = queue.SimpleQueue()
+        self._stopped = threading.Event()
+        self.batches = 0
+        self.operations = 0
+        self.failures = 0
+
+    def submit(self, operation, *args):
+        """Queue operation(cursor, *args) on the current shard; returns a Future of its result"""
+        if self._stopped.is_set():
+            raise RuntimeError("The writer has been stopped")
+        future = Future()
+        self._queue.put((Database.current_shard(), operation, args, future))
+        return future
+
+    def stop(self):
+        """Finish the queued operations and end the thread"""
+        self._stopped.set()
+        self._queue.put(None)
+        self.join()
+
+    def _take_batch(self):
+        """Block for one operation, then gather more until the batch is full or the deadline passes"""
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def run(self):
+        while True:
+            batch = self._take_batch()
+            if batch is None:
+                return
+            by_shard = {}
+            for item in batch:
+                by_shard.setdefault(item[0], []).append(item[1:])
+            for shard, items in by_shard.items():
+                with Database.use_shard(shard):
+                    self._commit(items)
+
+    def _commit(self, items):
+        items = [item for item in items if item[2].set_running_or_notify_cancel()]
+        outcomes = []
+        try:
+            with CursorFromConnectionPool() as cursor:
+                cursor.execute("BEGIN IMMEDIATE")
+                for operation, args, future in items:
+                    cursor.execute("SAVEPOINT operation")
+                    try:
+                        result = operation(cursor, *args)
+                    except Exception as e:
+                        cursor.execute("ROLLBACK TO operation")
+                        outcomes.append((future, None, e))
+                    else:
+                        outcomes.append((future, result, None))
+                    cursor.execute("RELEASE operation")
+        except Exception as e:
+            # The transaction itself failed, so nothing in the batch was written
+            logger.exception("Group commit of %d operation(s) failed", len(items))
+            self.failures += len(items)
+            for item in items:
+                item[2].set_exception(e)
+            return
+
+        self.batches += 1
+        self.operations += len(outcomes)
+        for future, result, error in outcomes:
+            if error is None:
+                future.set_result(result)
+            else:
+                self.failures += 1
+                future.set_exception(error)
+
+    def stats(self):
+        return {
+            'batches': self.batches,
+            'operations': self.operations,
+            'failures': self.failures,
+            'queued': self._queue.qsize(),
+        }
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def configure(enabled=None, max_batch=None, max_delay=None):
+    """(Re)start or turn off the writer thread; unspecified settings come from the environment"""
+    global _writer
+    if enabled is None:
+        enabled = os.environ.get('BLOOD_BANK_WRITE_BATCHING', 'off').lower() in ('1', 'on', 'true')
+    if max_batch is None:
+        max_batch = int(os.environ.get('BLOOD_BANK_WRITE_BATCH', 64))
+    if max_delay is None:
+        max_delay = float(os.environ.get('BLOOD_BANK_WRITE_DELAY_MS', 0)) / 1000.0
+
+    writer = None
+    if enabled:
+        writer = GroupCommitWriter(max_batch, max_delay)
+        writer.start()
+    with _writer_lock:
+        previous, _writer = _writer, writer
+    if previous is not None:
+        previous.stop()
+
+
+def current_writer():
+    """The running GroupCommitWriter, or None when batching is off"""
+    return _writer
+
+
+def submit(operation, *args):
+    """Apply operation(cursor, *args) in a write transaction; returns a Future of its result
+
+    The operation runs after BEGIN IMMEDIATE, so it holds the write lock,
+    and must not commit or open a transaction of its own. Work that has to
+    follow the commit, such as cache invalidation, belongs to the caller
+    once the future is done.
+    """
+    writer = _writer
+    if writer is None:
+        return _apply_now(operation, args)
+    return writer.submit(operation, *args)
+
+
+def execute(operation, *args, timeout=RESULT_TIMEOUT):
+    """submit() and wait for the result, re-raising the operation's exception
+
+    Raises WriteTimeoutError if the result is not ready within timeout
+    seconds.
+    """
+    future = submit(operation, *args)
+    try:
+        return future.result(timeout)
+    except FutureTimeoutError:
+        raise WriteTimeoutError(future) from None